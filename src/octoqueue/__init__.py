@@ -1,6 +1,10 @@
 """Documentation about octoqueue."""
 
 import logging
+from .aqueue import AsyncGithubQueue
+from .queue import EnqueueManyError
+from .queue import GithubQueue
+from .queue import extract_json
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 
@@ -8,4 +12,4 @@ __author__ = "Stephan Heuel"
 __email__ = "mail@ping13.net"
 __version__ = "0.1.0"
 
-from .queue import *
+__all__ = ["AsyncGithubQueue", "EnqueueManyError", "GithubQueue", "extract_json"]
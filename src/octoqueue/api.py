@@ -1,8 +1,8 @@
 import asyncio
 import logging
-import os
 import time
 import uuid
+from collections import deque
 from contextlib import asynccontextmanager
 from typing import Any
 import httpx
@@ -14,10 +14,16 @@ from fastapi import HTTPException
 from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from github import GithubException
+from jsonschema import SchemaError
 from jsonschema import ValidationError
-from jsonschema import validate
+from jsonschema.validators import validator_for
 from pydantic import BaseModel
+from pydantic import Field
+from pydantic_settings import BaseSettings
 from .queue import GithubQueue
+from .webhook import JobMirror
+from .webhook import router as webhook_router
 
 # Load environment variables
 load_dotenv()
@@ -30,41 +36,84 @@ logging.basicConfig(
 logger = logging.getLogger("octoqueue.api")
 
 
-# Get configuration from environment variables
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://127.0.0.1:5173")
-# Convert comma-separated string to list of origins, handling wildcards for localhost
-ALLOWED_ORIGINS_LIST = []
-for origin in [o.strip() for o in ALLOWED_ORIGINS.split("|")]:
-    ALLOWED_ORIGINS_LIST.append(origin)
+class Settings(BaseSettings):
+    """API configuration, read once from environment variables"""
 
-API_KEY = os.getenv("API_KEY")
-GITHUB_REPO = os.getenv("GITHUB_REPO")
-GITHUB_TOKEN = os.getenv("GH_TOKEN")  # Get GitHub token from environment
-RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "5"))
-RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
-RATE_LIMIT_BYPASS_KEY = os.getenv("RATE_LIMIT_BYPASS_KEY", None)
-TOPOPRINT_HOST = os.getenv("TOPOPRINT_HOST")
+    allowed_origins: str = "http://127.0.0.1:5173"
+    api_key: str | None = None
+    github_repo: str | None = None
+    github_token: str | None = Field(default=None, validation_alias="GH_TOKEN")
+    rate_limit_requests: int = 5
+    rate_limit_window: int = 60  # seconds
+    rate_limit_bypass_key: str | None = None
+    topoprint_host: str | None = None
+    cluster_status_ttl: float = 10  # seconds
+    # SQLite file mirroring pending jobs from GitHub webhooks, shared with the workers
+    job_db: str | None = None
+    webhook_secret: str | None = None
+
+
+settings = Settings()
+
+# Convert "|"-separated string to list of origins
+ALLOWED_ORIGINS_LIST = [o.strip() for o in settings.allowed_origins.split("|")]
+# Set for O(1) membership checks in the CORS logging middleware
+ALLOWED_ORIGINS_SET = frozenset(ALLOWED_ORIGINS_LIST)
 
 
 # Schema for job validation
 JOB_SCHEMA = None
+# Validator compiled from JOB_SCHEMA, reused across requests
+JOB_VALIDATOR = None
 
 # Validate required environment variables
-if not API_KEY:
+if not settings.api_key:
     logger.warning("API_KEY environment variable not set. API will be unsecured!")
 
-if not GITHUB_REPO:
+if not settings.github_repo:
     logger.error("GITHUB_REPO environment variable not set. API will not function correctly!")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info(f"API started with allowed origins: {ALLOWED_ORIGINS_LIST}")
+    logger.info("API started with allowed origins: %s", ALLOWED_ORIGINS_LIST)
+    app.state.settings = settings
+    # Share one client (and its keep-alive connection pool) across all requests
+    app.state.http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(60.0),
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=30),
+    )
+    app.state.job_mirror = JobMirror(settings.job_db) if settings.job_db else None
+    # Build the queue once; GithubQueue() costs GitHub round-trips (repo lookup, labels)
+    app.state.queue = None
+    if settings.github_repo:
+        try:
+            app.state.queue = await asyncio.to_thread(
+                GithubQueue,
+                settings.github_repo,
+                token=settings.github_token,
+            )
+        except Exception as e:
+            logger.error("Failed to initialize GitHub queue at startup: %s", e)
     yield  # App runs here
-
-
-# Simple in-memory rate limiting
-request_counts = {}
+    # Let in-flight topoprint pings finish before closing the client they use
+    if _background_tasks:
+        _, pending = await asyncio.wait(set(_background_tasks), timeout=BACKGROUND_TASKS_SHUTDOWN_TIMEOUT)
+        if pending:
+            logger.warning("Cancelling %d topoprint pings still running at shutdown", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+    await app.state.http_client.aclose()
+    if app.state.job_mirror is not None:
+        app.state.job_mirror.close()
+
+
+# Simple in-memory rate limiting: per-IP sliding window of monotonic timestamps
+request_counts: dict[str, deque[float]] = {}
+# Drop empty per-IP windows every this many requests to bound memory
+RATE_LIMIT_SWEEP_INTERVAL = 1000
+_rate_limit_calls = 0
 
 
 # Initialize FastAPI app
@@ -75,6 +124,8 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.include_router(webhook_router)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -85,19 +136,51 @@ app.add_middleware(
 )
 
 
-# Add middleware to log CORS requests
-@app.middleware("http")
-async def log_cors_requests(request: Request, call_next):
-    origin = request.headers.get("origin")
-    if origin:
-        logger.info(f"Received request with Origin: {origin}")
-        if origin in ALLOWED_ORIGINS_LIST:
-            logger.info(f"Origin {origin} is in allowed list")
-        else:
-            logger.warning(f"Origin {origin} is NOT in allowed list: {ALLOWED_ORIGINS_LIST}")
+# Pure ASGI middleware to log CORS requests (avoids BaseHTTPMiddleware overhead)
+class CORSLogMiddleware:
+    def __init__(self, app):
+        self.app = app
 
-    response = await call_next(request)
-    return response
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value.decode("latin-1")
+                logger.info("Received request with Origin: %s", origin)
+                if origin in ALLOWED_ORIGINS_SET:
+                    logger.info("Origin %s is in allowed list", origin)
+                else:
+                    logger.warning("Origin %s is NOT in allowed list: %s", origin, ALLOWED_ORIGINS_LIST)
+                break
+
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(CORSLogMiddleware)
+
+
+# Pure ASGI middleware to log unhandled errors, with the request they broke;
+# deliberate error responses (HTTPException) are logged where they are raised
+class ServerErrorLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            logger.exception("Unhandled error in %s %s", scope["method"], scope["path"])
+            raise
+
+
+app.add_middleware(ServerErrorLogMiddleware)
 
 
 # Request models
@@ -120,7 +203,7 @@ class SchemaRequest(BaseModel):
 
 # Dependency for API key validation
 def verify_api_key(x_api_key: str = Header(None)):
-    if not API_KEY:
+    if not settings.api_key:
         # If API_KEY is not set, skip validation but log a warning
         logger.warning("API request processed without API key validation")
         raise HTTPException(status_code=403, detail="No API key set server side")
@@ -129,190 +212,284 @@ def verify_api_key(x_api_key: str = Header(None)):
         logger.warning("API request processed without API key validation")
         raise HTTPException(status_code=403, detail="No API key given client side")
 
-    if x_api_key != API_KEY:
-        logger.warning(f"Invalid API key attempt: {x_api_key[:5]}...")
+    if x_api_key != settings.api_key:
+        logger.warning("Invalid API key attempt: %s...", x_api_key[:5])
         raise HTTPException(status_code=403, detail="Invalid API key")
     return x_api_key
 
 
 # Dependency for rate limiting
 def check_rate_limit(request: Request):
-    if not RATE_LIMIT_REQUESTS:
+    if not settings.rate_limit_requests:
         return
 
-    if request.headers.get("x-bypass-ratelimit", "") == RATE_LIMIT_BYPASS_KEY:
+    if request.headers.get("x-bypass-ratelimit", "") == settings.rate_limit_bypass_key:
         logger.info("Bypassing rate limiting because RATE_LIMIT_BYPASS_KEY was set")
         return
 
     client_ip = request.client.host
-    current_time = time.time()
+    if _is_rate_limited(client_ip, time.monotonic()):
+        logger.warning("Rate limit exceeded for IP: %s", client_ip)
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
 
-    # Clean up old entries
-    for ip in list(request_counts.keys()):
-        if current_time - request_counts[ip]["timestamp"] > RATE_LIMIT_WINDOW:
+def _is_rate_limited(client_ip: str, now: float) -> bool:
+    """Record a request of client_ip at monotonic time now, unless it exceeds the limit"""
+    global _rate_limit_calls
+
+    # Periodically remove idle clients instead of scanning all of them per request
+    _rate_limit_calls += 1
+    if _rate_limit_calls >= RATE_LIMIT_SWEEP_INTERVAL:
+        _rate_limit_calls = 0
+        for ip in [ip for ip, dq in request_counts.items() if not dq or now - dq[-1] > settings.rate_limit_window]:
             del request_counts[ip]
 
+    dq = request_counts.get(client_ip)
+    if dq is None:
+        dq = deque()
+        request_counts[client_ip] = dq
+
+    # Expire timestamps that fell out of this client's window
+    while dq and now - dq[0] > settings.rate_limit_window:
+        dq.popleft()
+
     # Check if client has exceeded rate limit
-    if client_ip in request_counts:
-        if request_counts[client_ip]["count"] >= RATE_LIMIT_REQUESTS:
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            raise HTTPException(status_code=429, detail="Rate limit exceeded")
-        request_counts[client_ip]["count"] += 1
-    else:
-        request_counts[client_ip] = {"count": 1, "timestamp": current_time}
-
-
-# Dependency to get queue instance
-def get_queue():
-    if not GITHUB_REPO:
+    if len(dq) >= settings.rate_limit_requests:
+        return True
+    dq.append(now)
+    return False
+
+
+# Dependency to get the shared queue instance
+def get_queue(request: Request) -> GithubQueue:
+    queue = getattr(request.app.state, "queue", None)
+    if queue is not None:
+        return queue
+
+    if not settings.github_repo:
         raise HTTPException(status_code=500, detail="GITHUB_REPO environment variable not set")
     try:
-        return GithubQueue(GITHUB_REPO, token=GITHUB_TOKEN)
+        queue = GithubQueue(settings.github_repo, token=settings.github_token)
+        request.app.state.queue = queue
+        return queue
     except ValueError as e:
-        logger.error(f"Failed to initialize GitHub queue: {e!s}")
+        logger.error("Failed to initialize GitHub queue: %s", e)
         raise HTTPException(status_code=500, detail=f"Queue initialization error: {e!s}")
     except Exception as e:
-        logger.error(f"Unexpected error initializing queue: {e!s}")
+        logger.error("Unexpected error initializing queue: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def get_job_validator():
+    """Return the compiled validator for the current JOB_SCHEMA, or None if unset"""
+    global JOB_VALIDATOR
+    if JOB_SCHEMA is None:
+        return None
+    if JOB_VALIDATOR is None or JOB_VALIDATOR.schema is not JOB_SCHEMA:
+        JOB_VALIDATOR = validator_for(JOB_SCHEMA)(JOB_SCHEMA)
+    return JOB_VALIDATOR
+
+
 # Error handler
-@app.exception_handler(Exception)
-async def generic_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {exc!s}", exc_info=True)
+@app.exception_handler(GithubException)
+async def github_exception_handler(request: Request, exc: GithubException):
+    logger.error("GitHub API error: %s", exc, exc_info=True)
     return JSONResponse(
-        status_code=500,
-        content={"detail": "An unexpected error occurred"},
+        status_code=502,
+        content={"detail": "GitHub API error"},
     )
 
 
-async def ping_topoprint_async(topoprint_host, request_id=None):
+@app.exception_handler(ValidationError)
+async def validation_exception_handler(request: Request, exc: ValidationError):
+    logger.warning("Job data validation failed: %s", exc.message)
+    return JSONResponse(
+        status_code=400,
+        content={"detail": f"Job data does not match required schema: {exc.message}"},
+    )
+
+
+async def ping_topoprint_async(topoprint_host, client, request_id=None):
     """Asynchronously ping the topoprint endpoint with enhanced exception logging
 
     Args:
         topoprint_host (str): The host URL for topoprint
+        client (httpx.AsyncClient): Shared client used to send the request
         request_id (str, optional): Unique identifier to track this specific request
 
     Returns:
         str: Status of the ping ("scheduled", "unscheduled", or "error")
     """
     request_id = request_id or uuid.uuid4().hex[:8]
-    logger.info(f"[{request_id}] Starting topoprint ping to host: {topoprint_host}")
+    logger.info("[%s] Starting topoprint ping to host: %s", request_id, topoprint_host)
 
     try:
-        async with httpx.AsyncClient() as client:
-            run_the_queue_url = f"{topoprint_host}/run-the-queue"
+        run_the_queue_url = f"{topoprint_host}/run-the-queue"
 
-            logger.info(f"[{request_id}] Pinging topoprint endpoint: {run_the_queue_url}")
+        logger.info("[%s] Pinging topoprint endpoint: %s", request_id, run_the_queue_url)
 
-            response = await client.post(
-                run_the_queue_url,
-                timeout=60.0,
-                headers={"X-Request-ID": request_id},
-            )
+        response = await client.post(
+            run_the_queue_url,
+            timeout=60.0,
+            headers={"X-Request-ID": request_id},
+        )
 
-            if response.status_code == 200:
-                logger.info(f"[{request_id}] Successfully pinged topoprint endpoint")
-                return "scheduled"
+        if response.status_code == 200:
+            logger.info("[%s] Successfully pinged topoprint endpoint", request_id)
+            return "scheduled"
 
-            logger.warning(
-                f"[{request_id}] Topoprint queue ping failed with status code: {response.status_code}, "
-                f"Response: {response.text[:200]}",
-            )
-            return "unscheduled"
+        logger.warning(
+            "[%s] Topoprint queue ping failed with status code: %s, Response: %s",
+            request_id,
+            response.status_code,
+            response.text[:200],
+        )
+        return "unscheduled"
 
     except httpx.TimeoutException as e:
         # Log with both string representation and exception info
         logger.error(
-            f"[{request_id}] Timeout while pinging topoprint endpoint: {e!r}",
+            "[%s] Timeout while pinging topoprint endpoint: %r",
+            request_id,
+            e,
             exc_info=True,
         )
         return "error"
     except httpx.RequestError as e:
         logger.error(
-            f"[{request_id}] Network error while pinging topoprint endpoint: {e!r}",
+            "[%s] Network error while pinging topoprint endpoint: %r",
+            request_id,
+            e,
             exc_info=True,
         )
         return "error"
     except Exception as e:
         # Log multiple representations of the exception
-        error_message = (
-            f"[{request_id}] Unexpected error while pinging topoprint endpoint:\n"
-            f"Type: {type(e).__name__}\n"
-            f"Repr: {e!r}\n"
-            f"Str: {e!s}"
+        logger.error(
+            "[%s] Unexpected error while pinging topoprint endpoint:\nType: %s\nRepr: %r\nStr: %s",
+            request_id,
+            type(e).__name__,
+            e,
+            e,
+            exc_info=True,
         )
-        logger.error(error_message, exc_info=True)
         return "error"
 
 
+# Strong references to in-flight topoprint pings, and a cap on how many run at once
+_background_tasks: set[asyncio.Task] = set()
+_ping_semaphore = asyncio.Semaphore(32)
+# Seconds the shutdown waits for in-flight pings before cancelling them
+BACKGROUND_TASKS_SHUTDOWN_TIMEOUT = 10
+
+
+async def _bounded_ping_topoprint(topoprint_host, client):
+    async with _ping_semaphore:
+        return await ping_topoprint_async(topoprint_host, client)
+
+
+# Cached cluster status: (monotonic expiry, 503 detail message or None if healthy)
+_cluster_status_cache: tuple[float, str | None] = (0.0, None)
+_cluster_status_lock = asyncio.Lock()
+
+
+async def _probe_cluster_status(client, topoprint_host):
+    """Query the cluster status endpoint once
+
+    Returns:
+        str | None: None if the cluster is healthy, otherwise the detail for a 503 response
+    """
+    try:
+        status_url = f"{topoprint_host}/cluster/status"
+        logger.info("Checking cluster status at: %s", status_url)
+        response = await client.get(status_url, timeout=10.0)
+
+        if response.status_code != 200:
+            logger.warning("Cluster status check failed with status code: %s", response.status_code)
+            return f"Service is temporarily unavailable (cluster status code={response.status_code})"
+
+        status_data = response.json()
+        if not status_data.get("status") == "healthy":
+            logger.warning("Cluster reported unhealthy status: %s", status_data)
+            return "Service may be overloaded"
+
+        logger.info("Cluster status check passed")
+        return None
+    except Exception as e:
+        logger.error("Failed to check cluster status: %s", e)
+        return f"Service is temporarily unavailable (error={e!s})"
+
+
+async def check_cluster_status(client, topoprint_host):
+    """Check the cluster status, reusing the last result for settings.cluster_status_ttl seconds
+
+    Returns:
+        str | None: None if the cluster is healthy, otherwise the detail for a 503 response
+    """
+    global _cluster_status_cache
+    expires_at, detail = _cluster_status_cache
+    if time.monotonic() < expires_at:
+        return detail
+
+    async with _cluster_status_lock:
+        # Another request may have refreshed the status while we were waiting
+        expires_at, detail = _cluster_status_cache
+        if time.monotonic() < expires_at:
+            return detail
+
+        detail = await _probe_cluster_status(client, topoprint_host)
+        _cluster_status_cache = (time.monotonic() + settings.cluster_status_ttl, detail)
+        return detail
+
+
 # Routes
 @app.post("/create-job", response_model=JobResponse, status_code=201)
 async def create_job(
     job_request: JobRequest,
+    request: Request,
     rate_limit: None = Depends(check_rate_limit),
     queue: GithubQueue = Depends(get_queue),
 ):
     """Create a new job in the queue"""
     # Check if TOPOPRINT_HOST is overloaded
-    if TOPOPRINT_HOST:
-        try:
-            async with httpx.AsyncClient() as client:
-                status_url = f"{TOPOPRINT_HOST}/cluster/status"
-                logger.info(f"Checking cluster status at: {status_url}")
-                response = await client.get(status_url, timeout=10.0)
-
-                if response.status_code != 200:
-                    logger.warning(f"Cluster status check failed with status code: {response.status_code}")
-                    raise HTTPException(
-                        status_code=503,
-                        detail=f"Service is temporarily unavailable (cluster status code={response.status_code})",
-                    )
-
-                status_data = response.json()
-                if not status_data.get("status") == "healthy":
-                    logger.warning(f"Cluster reported unhealthy status: {status_data}")
-                    raise HTTPException(status_code=503, detail="Service may be overloaded")
-
-                logger.info("Cluster status check passed")
-        except Exception as e:
-            logger.error(f"Failed to check cluster status: {e!s}")
-            raise HTTPException(status_code=503, detail=f"Service is temporarily unavailable (error={e!s})")
-    else:
+    topoprint_host = settings.topoprint_host
+    if not topoprint_host:
         raise HTTPException(status_code=503, detail="Service host is undefined")
 
-    try:
-        # Validate against schema if one is set
-        if JOB_SCHEMA is not None:
-            logger.info(f"validating job request against {JOB_SCHEMA}")
-            validate(instance=job_request.data, schema=JOB_SCHEMA)
-
-        job_id = queue.enqueue(
-            data=job_request.data,
-            title=job_request.title,
-            additional_labels=job_request.additional_labels,
-        )
-        logger.info(f"Octoqueue Job created successfully: {job_id}")
-
-        # Start async task to ping topoprint without waiting for result
-        processing_status = "unknown"
-        assert TOPOPRINT_HOST, "unknown TOPOPRINT_HOST"
-
-        # Create a background task that won't block the response
-        asyncio.create_task(ping_topoprint_async(TOPOPRINT_HOST))
-        processing_status = "scheduled"
-        logger.info(f"created task for {TOPOPRINT_HOST}")
-
-        return {"job_id": job_id, "status": "pending", "processing_status": processing_status}
-    except ValidationError as e:
-        logger.warning(f"Job data validation failed: {e}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Job data does not match required schema: {e!s}",
-        )
-    except Exception as e:
-        logger.error(f"Failed to create job: {e!s}")
-        raise HTTPException(status_code=500, detail=f"Failed to create job: {e!s}")
+    client = request.app.state.http_client
+    unavailable_detail = await check_cluster_status(client, topoprint_host)
+    if unavailable_detail is not None:
+        raise HTTPException(status_code=503, detail=unavailable_detail)
+
+    # Validate against schema if one is set; validation_exception_handler answers mismatches
+    validator = get_job_validator()
+    if validator is not None:
+        # The schema repr can be large, only build it if the record is emitted
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("validating job request against %r", JOB_SCHEMA)
+        validator.validate(job_request.data)
+
+    # PyGithub is blocking; run it in a worker thread to keep the event loop free.
+    # GitHub errors are answered by github_exception_handler
+    job_id = await asyncio.to_thread(
+        queue.enqueue,
+        data=job_request.data,
+        title=job_request.title,
+        additional_labels=job_request.additional_labels,
+    )
+    logger.info("Octoqueue Job created successfully: %s", job_id)
+
+    # Start async task to ping topoprint without waiting for result
+    processing_status = "unknown"
+
+    # Create a background task that won't block the response
+    task = asyncio.create_task(_bounded_ping_topoprint(topoprint_host, client))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    processing_status = "scheduled"
+    logger.info("created task for %s", topoprint_host)
+
+    return {"job_id": job_id, "status": "pending", "processing_status": processing_status}
 
 
 @app.get("/health")
@@ -327,8 +504,15 @@ def set_job_schema(
     api_key: str = Depends(verify_api_key),
 ):
     """Set a JSON schema for job validation"""
-    global JOB_SCHEMA
+    global JOB_SCHEMA, JOB_VALIDATOR
+    validator_cls = validator_for(schema_request.job_schema)
+    try:
+        validator_cls.check_schema(schema_request.job_schema)
+    except SchemaError as e:
+        logger.warning("Rejected invalid job schema: %s", e.message)
+        raise HTTPException(status_code=400, detail=f"Invalid JSON schema: {e.message}")
     JOB_SCHEMA = schema_request.job_schema
+    JOB_VALIDATOR = validator_cls(JOB_SCHEMA)
     logger.info("Job schema updated successfully")
     return {"status": "success", "message": "Schema updated successfully"}
 
@@ -0,0 +1,320 @@
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any
+from typing import Literal
+import httpx
+from .queue import _COUNT_OPEN_QUERY
+from .queue import DEQUEUE_CANDIDATES
+from .queue import REQUIRED_LABELS
+from .queue import _job_body
+from .queue import _load_dotenv
+from .queue import extract_json
+
+GITHUB_API_URL = "https://api.github.com"
+# Concurrent per-job requests in get_jobs; GitHub's secondary rate limit punishes bursts
+EVENTS_CONCURRENCY = 8
+
+
+class AsyncGithubQueue:
+    """Asyncio variant of GithubQueue talking to the GitHub REST API through httpx
+
+    Independent requests of a state transition (label changes, comment, state) are
+    sent concurrently, so a transition costs about one round-trip instead of several.
+    Use ``await AsyncGithubQueue.create(...)`` to also make sure the labels exist.
+    """
+
+    __slots__ = ("_client", "_headers", "_owns_client", "logger", "repo")
+
+    def __init__(self, repo: str, token: str = None, client: httpx.AsyncClient | None = None):
+        # Allow passing token directly or fallback to environment variable
+        if not token:
+            _load_dotenv()
+            token = os.getenv("GH_TOKEN")
+
+        if not token:
+            raise ValueError("GitHub token not provided and GH_TOKEN not found in environment")
+
+        self.repo = repo
+        self._headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        self._owns_client = client is None
+        self._client = client or httpx.AsyncClient(
+            base_url=GITHUB_API_URL,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    async def create(cls, repo: str, token: str = None, client: httpx.AsyncClient | None = None) -> "AsyncGithubQueue":
+        """Create a queue and make sure the required labels exist"""
+        queue = cls(repo, token=token, client=client)
+        await queue._ensure_labels()
+        return queue
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client if it was created by this queue"""
+        if self._owns_client:
+            await self._client.aclose()
+
+    async def __aenter__(self) -> "AsyncGithubQueue":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def _request(self, method: str, path: str, ignore_404: bool = False, **kwargs) -> httpx.Response:
+        """Send a request for a path relative to the repository and raise on HTTP errors"""
+        response = await self._client.request(method, f"/repos/{self.repo}{path}", headers=self._headers, **kwargs)
+        if ignore_404 and response.status_code == 404:
+            return response
+        response.raise_for_status()
+        return response
+
+    async def _graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        """Run a GraphQL query and return its data, raising on HTTP and GraphQL errors"""
+        response = await self._client.post(
+            "/graphql",
+            json={"query": query, "variables": variables},
+            headers=self._headers,
+        )
+        response.raise_for_status()
+        result = response.json()
+        if result.get("errors"):
+            # GraphQL reports errors with a 200, raise them like the HTTP errors
+            raise httpx.HTTPStatusError(
+                f"GraphQL errors: {result['errors']}",
+                request=response.request,
+                response=response,
+            )
+        return result["data"]
+
+    async def _paginate(self, path: str, params: dict[str, Any]) -> list[dict[str, Any]]:
+        """Fetch all pages of a list endpoint"""
+        items = []
+        response = await self._request("GET", path, params={**params, "per_page": 100})
+        items.extend(response.json())
+        while "next" in response.links:
+            response = await self._client.get(response.links["next"]["url"], headers=self._headers)
+            response.raise_for_status()
+            items.extend(response.json())
+        return items
+
+    async def _ensure_labels(self) -> None:
+        """Create required labels if they don't exist"""
+        existing = {label["name"] for label in await self._paginate("/labels", {})}
+        await asyncio.gather(
+            *(
+                self._request("POST", "/labels", json={"name": name, "color": REQUIRED_LABELS[name]})
+                for name in REQUIRED_LABELS.keys() - existing
+            ),
+        )
+
+    async def _transition(
+        self,
+        job_id: int,
+        remove: set[str],
+        add: set[str],
+        new_state: str | None = None,
+        comment: str | None = None,
+    ) -> None:
+        """Change labels and state of a job, sending the independent requests concurrently"""
+        requests = [self._request("DELETE", f"/issues/{job_id}/labels/{label}", ignore_404=True) for label in remove]
+        requests.append(self._request("POST", f"/issues/{job_id}/labels", json={"labels": sorted(add)}))
+        if new_state:
+            requests.append(self._request("PATCH", f"/issues/{job_id}", json={"state": new_state}))
+        if comment:
+            requests.append(self._request("POST", f"/issues/{job_id}/comments", json={"body": comment}))
+        await asyncio.gather(*requests)
+
+    async def enqueue(self, data: dict[str, Any], title: str = None, additional_labels: list = None) -> int:
+        """Add a job to the queue"""
+        if title is None:
+            title = f"Job {time.time_ns()}"
+
+        labels = ["pending"]
+        if additional_labels:
+            labels.extend(additional_labels)
+        try:
+            response = await self._request(
+                "POST",
+                "/issues",
+                json={
+                    "title": title,
+                    "body": _job_body(data),
+                    "labels": labels,
+                },
+            )
+            return response.json()["number"]
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to enqueue job: %s", e)
+            raise
+
+    async def count_open(self) -> int:
+        """Count the pending and processing issues"""
+        owner, name = self.repo.split("/", 1)
+        # Both counts in a single GraphQL request, without listing the issues
+        repository = (await self._graphql(_COUNT_OPEN_QUERY, {"owner": owner, "name": name}))["repository"]
+        return repository["pending"]["totalCount"] + repository["processing"]["totalCount"]
+
+    async def dequeue(self) -> tuple[int, dict[str, Any]] | None:
+        """Get and claim next pending job
+
+        Removing the "pending" label is the claim: GitHub answers 404 to every
+        worker but the first, which move on to the next candidate.
+        """
+        try:
+            response = await self._request(
+                "GET",
+                "/issues",
+                params={
+                    "labels": "pending",
+                    "state": "open",
+                    "sort": "created",
+                    "direction": "asc",
+                    "per_page": DEQUEUE_CANDIDATES,
+                },
+            )
+            for issue in response.json():
+                claim = await self._request("DELETE", f"/issues/{issue['number']}/labels/pending", ignore_404=True)
+                if claim.status_code == 404:
+                    continue  # Another worker got there first
+                try:
+                    await self._request("POST", f"/issues/{issue['number']}/labels", json={"labels": ["processing"]})
+                except httpx.HTTPError:
+                    # Without either label no worker would ever see the job again
+                    await self._request("POST", f"/issues/{issue['number']}/labels", json={"labels": ["pending"]})
+                    raise
+                return (issue["number"], extract_json(issue["body"]))
+
+            self.logger.info(
+                "You tried to dequeue, but I couldn't find open issued that are labelled with 'pending'",
+            )
+            return None
+
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to dequeue job: %s", e)
+            raise
+
+    async def fail(self, job_id: int, comment: str = None) -> None:
+        """Mark job as failed"""
+        if comment is None:
+            comment = "This job has failed"
+        try:
+            await self._transition(job_id, {"processing"}, {"failed"}, "closed", comment)
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to mark job %s as failed: %s", job_id, e)
+            raise
+
+    async def create_comment(self, job_id: int, comment: str = None) -> None:
+        if comment is None:
+            return
+        try:
+            await self._request("POST", f"/issues/{job_id}/comments", json={"body": comment})
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to comment on job %s: %s", job_id, e)
+            raise
+
+    async def complete(self, job_id: int, comment: str = None) -> None:
+        """Mark job as complete"""
+        if comment is None:
+            comment = "This has been completed, thank you"
+        try:
+            await self._transition(job_id, {"processing"}, {"completed"}, "closed", comment)
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to complete job %s: %s", job_id, e)
+            raise
+
+    async def requeue(self, job_id: int, comment: str = None) -> None:
+        """Put a job back in the queue for reprocessing"""
+        if comment is None:
+            comment = "Job has been requeued for processing"
+        try:
+            await self._transition(job_id, {"processing", "completed"}, {"pending"}, "open", comment)
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to requeue job %s: %s", job_id, e)
+            raise
+
+    async def get_job_status(self, job_id: int) -> str | None:
+        """Get the status of a job by its ID.
+
+        Args:
+            job_id: The ID of the job to check
+
+        Returns:
+            The status of the job as a string ('pending', 'processing', 'completed', 'failed')
+            or None if the job doesn't exist
+        """
+        response = await self._request("GET", f"/issues/{job_id}", ignore_404=True)
+        if response.status_code == 404:
+            return None  # Issue doesn't exist; rate limits and server errors raise
+        issue = response.json()
+
+        labels = {label["name"] for label in issue["labels"]}
+        if issue["state"] == "closed":
+            if "completed" in labels:
+                return "completed"
+            if "failed" in labels:
+                return "failed"
+            return None  # Closed but not completed or failed
+        if "processing" in labels:
+            return "processing"
+        if "pending" in labels:
+            return "pending"
+        return None  # Open but not part of our queue
+
+    async def _labeled_time(self, job_id: int, labels: set[str], limit: asyncio.Semaphore) -> datetime | None:
+        """Return when one of the labels was first added to the job"""
+        async with limit:
+            events = await self._paginate(f"/issues/{job_id}/events", {})
+        for event in events:
+            if event["event"] == "labeled" and event["label"]["name"] in labels:
+                return datetime.fromisoformat(event["created_at"].replace("Z", "+00:00"))
+        return None
+
+    async def get_jobs(
+        self,
+        labels: Sequence[str] = ("processing",),
+        state: Literal["open", "closed"] = "open",
+        include_start_time: bool = False,
+    ) -> list[tuple[int, datetime, dict[str, Any]]]:
+        """Get all jobs with specified labels
+
+        Args:
+            labels: Label names to search for. Defaults to ("processing",)
+            state: State of issues to fetch ("open" or "closed"). Defaults to "open"
+            include_start_time: Look up when the matching label was added, which costs
+                one extra API request per job (up to EVENTS_CONCURRENCY at a time).
+                Defaults to False
+
+        Returns:
+            List of tuples containing (job_id, start_time, job_data)
+        """
+        try:
+            issues = await self._paginate("/issues", {"labels": ",".join(labels), "state": state})
+            parsed = [(issue, extract_json(issue["body"] or "")) for issue in issues]
+            parsed = [(issue, data) for issue, data in parsed if data is not None]
+
+            if include_start_time:
+                wanted = set(labels)
+                limit = asyncio.Semaphore(EVENTS_CONCURRENCY)
+                start_times = await asyncio.gather(
+                    *(self._labeled_time(issue["number"], wanted, limit) for issue, _ in parsed),
+                )
+            else:
+                start_times = [
+                    datetime.fromisoformat(issue["updated_at"].replace("Z", "+00:00")) for issue, _ in parsed
+                ]
+
+            return [(issue["number"], start_time, data) for (issue, data), start_time in zip(parsed, start_times)]
+
+        except httpx.HTTPError as e:
+            self.logger.error("Failed to get jobs with labels %s: %s", labels, e)
+            raise
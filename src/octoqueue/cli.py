@@ -1,3 +1,4 @@
+import importlib.util
 import logging
 import os
 import click
@@ -18,7 +19,14 @@ def cli():
 @click.option("--api-key", help="API key for authentication")
 @click.option("--log-level", default="info", help="Logging level")
 @click.option("--reload", is_flag=True, default=False, help="Enable auto-reload for development")
-def serve(host, port, repo, allowed_origin, api_key, log_level, reload):
+@click.option(
+    "--workers",
+    default=1,
+    type=int,
+    envvar="WEB_CONCURRENCY",
+    help="Number of worker processes (rate limits and job schema are kept per worker)",
+)
+def serve(host, port, repo, allowed_origin, api_key, log_level, reload, workers):
     """Run the OctoQueue API server"""
     # Configure logging
     numeric_level = getattr(logging, log_level.upper(), None)
@@ -54,7 +62,22 @@ def serve(host, port, repo, allowed_origin, api_key, log_level, reload):
     click.echo(f"Allowed origin: {os.environ.get('ALLOWED_ORIGIN', 'Not restricted')}")
     click.echo(f"API key authentication: {'Enabled' if os.environ.get('API_KEY') else 'Disabled'}")
 
-    uvicorn.run("octoqueue.api:app", host=host, port=port, reload=reload)
+    # Prefer the uvloop event loop and httptools parser from uvicorn[standard] when installed
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "auto"
+    http = "httptools" if importlib.util.find_spec("httptools") else "auto"
+    if reload:
+        workers = 1
+
+    uvicorn.run(
+        "octoqueue.api:app",
+        host=host,
+        port=port,
+        reload=reload,
+        loop=loop,
+        http=http,
+        workers=workers,
+        log_level=log_level,
+    )
 
 
 if __name__ == "__main__":
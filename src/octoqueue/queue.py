@@ -1,92 +1,349 @@
-import json
+import functools
 import logging
 import os
 import re
+import tempfile
 import time
+import warnings
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Any
+from typing import ClassVar
 from typing import Literal
+import orjson
 from dotenv import load_dotenv
 from github import Auth
 from github import Github
 from github import GithubException
+from github import GithubRetry
+from github import RateLimitExceededException
+from github import UnknownObjectException
+from github.Issue import Issue
+from github.Repository import Repository
 
-load_dotenv()
+if TYPE_CHECKING:
+    from .webhook import JobMirror
+
+
+_JSON_FENCE = "```json"
+# Issue body layout written by enqueue()
+_BODY_PREFIX = _JSON_FENCE + "\n"
+_BODY_SUFFIX = "\n```"
+# Like json.dumps, accept non-string keys (e.g. ints) and keep the body readable
+_BODY_DUMPS_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+_JSON_FENCE_RE = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+_JSON_BRACE_RE = re.compile(r"\{[^{]*\}")
+
+
+def _job_body(data: dict[str, Any]) -> str:
+    """Render job data as the issue body read back by extract_json"""
+    return _BODY_PREFIX + orjson.dumps(data, option=_BODY_DUMPS_OPTIONS).decode() + _BODY_SUFFIX
 
 
 def extract_json(text):
-    # Look for content between ```json and ``` markers
-    json_pattern = r"```json\s*(\{[^`]*\})\s*```"
-    match = re.search(json_pattern, text, re.DOTALL)
+    # Fast path: slice the ```json ... ``` block written by enqueue()
+    fence = text.find(_JSON_FENCE)
+    match = None
+    if fence != -1:
+        start = fence + len(_JSON_FENCE)
+        # JSON strings cannot hold raw newlines, so the first "\n```" closes the block
+        # even when the data itself contains backticks
+        end = text.find(_BODY_SUFFIX, start)
+        if end != -1:
+            try:
+                return orjson.loads(text[start:end])
+            except orjson.JSONDecodeError:
+                pass
+
+        # Look for content between ```json and ``` markers, only if there is a marker
+        match = _JSON_FENCE_RE.search(text, fence)
 
     if not match:
         # Fallback: try to find any content between curly braces
-        json_pattern = r"\{[^{]*\}"
-        match = re.search(json_pattern, text, re.DOTALL)
+        match = _JSON_BRACE_RE.search(text)
 
     if match:
         try:
             # Parse the extracted string as JSON
-            return json.loads(match.group(1))
-        except (json.JSONDecodeError, IndexError):
+            return orjson.loads(match.group(1))
+        except (orjson.JSONDecodeError, IndexError):
             try:
                 # If first attempt fails, try parsing the entire match
-                return json.loads(match.group(0))
-            except json.JSONDecodeError:
+                return orjson.loads(match.group(0))
+            except orjson.JSONDecodeError:
                 return None
 
     return None
 
 
+# Maximum number of pooled HTTPS connections to the GitHub API
+GITHUB_POOL_SIZE = 20
+
+# Pending issues dequeue() tries to claim from one listing before giving up
+DEQUEUE_CANDIDATES = 5
+
+# Issues created by one GraphQL request in enqueue_many()
+ENQUEUE_BATCH_SIZE = 25
+
+# Maximum number of ETag-validated responses kept per queue
+ETAG_CACHE_SIZE = 1024
+
+# Fetches the remaining pages of an issue listing once the first page tells how many there are
+_PAGE_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="octoqueue-page")
+_LAST_PAGE_RE = re.compile(r'[?&]page=(\d+)[^>]*>; rel="last"')
+
+_COUNT_OPEN_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    pending: issues(states: OPEN, labels: ["pending"]) { totalCount }
+    processing: issues(states: OPEN, labels: ["processing"]) { totalCount }
+  }
+}
+"""
+
+_JOBS_QUERY = """
+query($owner: String!, $name: String!, $labels: [String!], $states: [IssueState!], $after: String) {
+  repository(owner: $owner, name: $name) {
+    issues(first: 100, after: $after, labels: $labels, states: $states, orderBy: {field: CREATED_AT, direction: ASC}) {
+      pageInfo { endCursor hasNextPage }
+      nodes {
+        number
+        body
+        labels(first: 100) { nodes { name } }
+        timelineItems(first: 100, itemTypes: [LABELED_EVENT]) {
+          nodes { ... on LabeledEvent { createdAt label { name } } }
+        }
+      }
+    }
+  }
+}
+"""
+
+_NODE_IDS_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    id
+    labels(first: 100) { nodes { id name } }
+  }
+}
+"""
+
+# Retries of a GitHub request that hits the rate limit or a transient server error
+GITHUB_MAX_RETRIES = 4
+# Longest wait before a retry; a request that would have to wait longer fails instead,
+# rather than blocking its caller (e.g. an API request) until the rate limit resets
+GITHUB_MAX_RETRY_WAIT = 60
+
+
+class _QueueRetry(GithubRetry):
+    """Retry GitHub requests on rate limits, and on server errors where that is safe
+
+    A rate-limited request was rejected without effect, so it is retried whatever its
+    method. GitHub may have carried out a POST, PATCH or DELETE (e.g. created the
+    issue) before answering with a 5xx, so server errors are only retried for reads.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("total", GITHUB_MAX_RETRIES)
+        kwargs.setdefault("status_forcelist", [429, 502, 503, 504])
+        kwargs.setdefault("allowed_methods", frozenset({"GET", "HEAD"}))
+        kwargs.setdefault("backoff_factor", 1)
+        super().__init__(**kwargs)
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        # GithubRetry.increment only lets 403s through that are rate limits
+        if status_code in (403, 429):
+            method = "GET"
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if response is not None:
+            wait = max(retry.get_retry_after(response) or 0, retry.get_backoff_time())
+            if wait > GITHUB_MAX_RETRY_WAIT:
+                raise RateLimitExceededException(
+                    response.status,
+                    {"message": f"GitHub asks to wait {wait:.0f}s before retrying"},
+                    dict(response.headers),
+                )
+        return retry
+
+
+# Labels used by the queue and their colors
+REQUIRED_LABELS = {
+    "pending": "0dbf66",
+    "processing": "0052cc",
+    "completed": "2cbe4e",
+    "failed": "d93f0b",  # Red color for failed
+    "mastodon": "800080",
+}
+
+
+# Cross-process cache of the labels known to exist in a repository, kept per user
+# rather than in the shared temporary directory; None means $XDG_CACHE_HOME/octoqueue
+# or ~/.cache/octoqueue, looked up when the cache is first used
+LABELS_CACHE_DIR: Path | None = None
+LABELS_CACHE_TTL = 3600  # seconds
+
+
+@functools.cache
+def _load_dotenv() -> None:
+    """Read a .env file into the environment, once per process and only when needed"""
+    load_dotenv()
+
+
+def _labels_cache_path(repo_full_name: str) -> Path | None:
+    """Return the labels cache file of a repository, or None if there is no home to keep it in"""
+    cache_dir = LABELS_CACHE_DIR
+    if cache_dir is None:
+        try:
+            cache_dir = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "octoqueue"
+        except (RuntimeError, KeyError):
+            # e.g. a container without HOME or a passwd entry; check the labels every time
+            return None
+    return cache_dir / f"labels-{repo_full_name.replace('/', '__')}.json"
+
+
+def _read_labels_cache(path: Path) -> set[str]:
+    """Return the cached label names, or an empty set if the cache is missing or stale"""
+    try:
+        if time.time() - path.stat().st_mtime >= LABELS_CACHE_TTL:
+            return set()
+        return set(orjson.loads(path.read_bytes()))
+    except (OSError, orjson.JSONDecodeError):
+        return set()
+
+
+def _write_labels_cache(path: Path, labels: set[str]) -> None:
+    """Atomically replace the cached label names"""
+    try:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # mkstemp creates a new file, so a planted symlink can't redirect the write
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(sorted(labels)))
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except OSError as e:
+        logging.getLogger(__name__).debug("Could not write labels cache %s: %s", path, e)
+
+
+class EnqueueManyError(GithubException):
+    """GitHub failed while GithubQueue.enqueue_many was adding jobs
+
+    Attributes:
+        job_ids: IDs of the jobs created before the failure, in the order of the jobs
+    """
+
+    def __init__(self, cause: GithubException, job_ids: list[int]):
+        super().__init__(cause.status, cause.data, cause.headers)
+        self.job_ids = job_ids
+
+
 class GithubQueue:
-    def _safe_remove_label(self, issue, label: str) -> None:
-        """Safely remove a label from an issue, ignoring if it doesn't exist
+    # Fixed attribute layout: no per-instance __dict__, faster attribute access
+    __slots__ = ("_etags", "_node_ids", "_repo", "gh", "logger", "mirror", "repo_name")
+
+    # Repositories whose labels were already checked in this process
+    _labels_ensured_repos: ClassVar[set[str]] = set()
+
+    def _transition(
+        self,
+        issue: Issue,
+        remove: set[str],
+        add: set[str],
+        new_state: str | None = None,
+        comment: str | None = None,
+    ) -> None:
+        """Change the labels and state of a job with a single issue update
 
         Args:
-            issue: GitHub issue object
-            label: Name of label to remove
+            issue: The GitHub issue of the job, as already fetched
+            remove: Names of labels to remove
+            add: Names of labels to add
+            new_state: State to move the issue to ("open" or "closed"), if any
+            comment: Comment to add alongside the update, if any
         """
-        try:
-            issue.remove_from_labels(label)
-        except GithubException as e:
-            if e.status != 404:  # Only ignore 404 (not found) errors
-                raise
+        # The fetched issue already carries its labels, no extra request needed
+        current = {label.name for label in issue.labels}
+        labels = (current - remove) | add
+        kwargs = {}
+        if labels != current:
+            kwargs["labels"] = sorted(labels)
+        if new_state and issue.state != new_state:
+            kwargs["state"] = new_state
+        # e.g. requeueing a job that is already pending needs no update at all
+        if kwargs:
+            issue.edit(**kwargs)
+
+        # Only comment once the update went through, the comment announces it
+        if comment:
+            issue.create_comment(comment)
 
-    def __init__(self, repo: str, token: str = None):
+    def __init__(self, repo: str, token: str = None, mirror: "JobMirror | None" = None):
         # Allow passing token directly or fallback to environment variable
         if not token:
+            _load_dotenv()
             token = os.getenv("GH_TOKEN")
 
         if not token:
             raise ValueError("GitHub token not provided and GH_TOKEN not found in environment")
 
         auth = Auth.Token(token)
-        self.gh = Github(auth=auth)
-
-        self.repo = self.gh.get_repo(repo)
+        # PyGithub keeps one requests session per Github instance; size its pool so
+        # concurrent callers (API worker threads, page pool) reuse keep-alive connections
+        self.gh = Github(auth=auth, pool_size=GITHUB_POOL_SIZE, retry=_QueueRetry())
+
+        self.repo_name = repo
+        self._repo: Repository | None = None
+        # Optional webhook-fed copy of the pending jobs, consulted before the REST API
+        self.mirror = mirror
         self.logger = logging.getLogger(__name__)
+        # ETag and parsed result of conditional GET requests, by URL
+        self._etags: dict[str, tuple[str, Any]] = {}
+        # GraphQL node IDs of the repository and of its labels by name, see enqueue_many
+        self._node_ids: tuple[str, dict[str, str]] | None = None
         self._ensure_labels()
 
+    @property
+    def repo(self) -> Repository:
+        """The GitHub repository, looked up on first use"""
+        if self._repo is None:
+            self._repo = self.gh.get_repo(self.repo_name)
+        return self._repo
+
     def _ensure_labels(self) -> None:
         """Create required labels if they don't exist"""
-        required = {
-            "pending": "0dbf66",
-            "processing": "0052cc",
-            "completed": "2cbe4e",
-            "failed": "d93f0b",  # Red color for failed
-            "mastodon": "800080",
-        }
+        full_name = self.repo_name
+        if full_name in self._labels_ensured_repos:
+            return
 
-        existing = {label.name: label for label in self.repo.get_labels()}
+        # Another process may have checked the labels recently
+        cache_path = _labels_cache_path(full_name)
+        if cache_path is not None and _read_labels_cache(cache_path) >= REQUIRED_LABELS.keys():
+            self._labels_ensured_repos.add(full_name)
+            return
+
+        existing = {label.name for label in self.repo.get_labels()}
 
-        for name, color in required.items():
-            if name not in existing:
-                self.repo.create_label(name=name, color=color)
+        for name in REQUIRED_LABELS.keys() - existing:
+            self.repo.create_label(name=name, color=REQUIRED_LABELS[name])
+
+        if cache_path is not None:
+            _write_labels_cache(cache_path, existing | REQUIRED_LABELS.keys())
+        self._labels_ensured_repos.add(full_name)
 
     def enqueue(self, data: dict[str, Any], title: str = None, additional_labels: list = None) -> int:
         """Add a job to the queue"""
         if title is None:
-            title = f"Job {datetime.now().isoformat()}"
+            # Nanosecond timestamps sort by creation time and don't collide within a microsecond
+            title = f"Job {time.time_ns()}"
 
         labels = ["pending"]
         if additional_labels:
@@ -94,50 +351,178 @@ class GithubQueue:
         try:
             issue = self.repo.create_issue(
                 title=title,
-                body=f"```json\n{json.dumps(data, ensure_ascii=False, indent=2)}\n```",
+                body=_job_body(data),
                 labels=labels,
             )
             return issue.number
         except GithubException as e:
-            self.logger.error(f"Failed to enqueue job: {e}")
+            self.logger.error("Failed to enqueue job: %s", e)
             raise
 
-    def count_open(self, wait_sec=0) -> int:
-        """Count the pending and processing issues"""
-        time.sleep(wait_sec)  # if we want to improve the chances of having no race conditions
-        open_issues = self.repo.get_issues(state="open")
-        cnt = 0
-        for issue in open_issues:
-            labels = list(issue.get_labels())
-            for label in labels:
-                if label.name == "processing" or label.name == "pending":
-                    cnt += 1
-        return cnt
-
-    def dequeue(self, wait_sec=0) -> tuple[int, dict[str, Any]] | None:
-        """Get and claim next pending job"""
-        time.sleep(wait_sec)
-        try:
-            issues = self.repo.get_issues(labels=["pending"], state="open", sort="created")
+    def enqueue_many(
+        self,
+        jobs: list[dict[str, Any]],
+        titles: list[str] = None,
+        additional_labels: list = None,
+    ) -> list[int]:
+        """Add several jobs to the queue with one GraphQL request per ENQUEUE_BATCH_SIZE jobs
 
-            if len(list(issues)) == 0:
-                self.logger.info(
-                    "You tried to dequeue, but I couldn't find open issued that are labelled with 'pending'",
-                )
-                self.logger.info(list(issues))
-                return None
+        The createIssue mutations of a request run in order, so the jobs are dequeued
+        in the given order. GraphQL can't create missing labels on the fly like the
+        REST API does; if one of the labels doesn't exist, the jobs are added one by
+        one with enqueue().
+
+        Returns:
+            The job IDs, in the order of jobs
 
-            issue = issues[-1]
-            body = issue.body
-            data = extract_json(body)
+        Raises:
+            EnqueueManyError: if GitHub fails on the way; its job_ids tell which of the
+                jobs were created before, so a retry can skip them
+        """
+        if titles is None:
+            titles = [f"Job {time.time_ns()}" for _ in jobs]
+        elif len(titles) != len(jobs):
+            raise ValueError(f"Got {len(titles)} titles for {len(jobs)} jobs")
+
+        labels = ["pending"]
+        if additional_labels:
+            labels.extend(additional_labels)
+        job_ids = []
+        try:
+            repository_id, label_ids = self._graphql_node_ids()
+            if not label_ids.keys() >= set(labels):
+                # The labels may have been created since the IDs were looked up
+                repository_id, label_ids = self._graphql_node_ids(refresh=True)
+            if not label_ids.keys() >= set(labels):
+                for data, title in zip(jobs, titles, strict=True):
+                    job_ids.append(self.enqueue(data, title, additional_labels))
+                return job_ids
+
+            issues = [(title, _job_body(data)) for data, title in zip(jobs, titles, strict=True)]
+            for start in range(0, len(issues), ENQUEUE_BATCH_SIZE):
+                job_ids.extend(
+                    self._create_issues(
+                        repository_id,
+                        [label_ids[name] for name in labels],
+                        issues[start : start + ENQUEUE_BATCH_SIZE],
+                    ),
+                )
+            return job_ids
+        except GithubException as e:
+            if isinstance(e, EnqueueManyError):
+                job_ids.extend(e.job_ids)
+            self.logger.error("Failed to enqueue jobs, %d of %d created: %s", len(job_ids), len(jobs), e)
+            raise EnqueueManyError(e, job_ids) from e
+
+    def _graphql_node_ids(self, refresh: bool = False) -> tuple[str, dict[str, str]]:
+        """Look up the node IDs of the repository and its labels, once per queue"""
+        if self._node_ids is None or refresh:
+            owner, name = self.repo.full_name.split("/", 1)
+            _, data = self.repo._requester.graphql_query(_NODE_IDS_QUERY, {"owner": owner, "name": name})
+            repository = data["data"]["repository"]
+            self._node_ids = (
+                repository["id"],
+                {label["name"]: label["id"] for label in repository["labels"]["nodes"]},
+            )
+        return self._node_ids
+
+    def _create_issues(self, repository_id: str, label_ids: list[str], issues: list[tuple[str, str]]) -> list[int]:
+        """Create issues with aliased createIssue mutations in a single request"""
+        variables = {"repositoryId": repository_id, "labelIds": label_ids}
+        parameters = ["$repositoryId: ID!", "$labelIds: [ID!]"]
+        mutations = []
+        for i, (title, body) in enumerate(issues):
+            variables[f"title{i}"] = title
+            variables[f"body{i}"] = body
+            parameters += [f"$title{i}: String!", f"$body{i}: String"]
+            mutations.append(
+                f"j{i}: createIssue(input: {{repositoryId: $repositoryId, title: $title{i}, body: $body{i}, "
+                f"labelIds: $labelIds}}) {{ issue {{ number }} }}",
+            )
+        query = f"mutation({', '.join(parameters)}) {{ {' '.join(mutations)} }}"
+        try:
+            _, data = self.repo._requester.graphql_query(query, variables)
+        except GithubException as e:
+            # The mutations before a failing one have created their issues
+            created = (e.data.get("data") if isinstance(e.data, dict) else None) or {}
+            job_ids = [created[f"j{i}"]["issue"]["number"] for i in range(len(issues)) if created.get(f"j{i}")]
+            raise EnqueueManyError(e, job_ids) from e
+        return [data["data"][f"j{i}"]["issue"]["number"] for i in range(len(issues))]
 
+    def count_open(self) -> int:
+        """Count the pending and processing issues"""
+        owner, name = self.repo.full_name.split("/", 1)
+        # Both counts in a single GraphQL request
+        _, data = self.repo._requester.graphql_query(_COUNT_OPEN_QUERY, {"owner": owner, "name": name})
+        repository = data["data"]["repository"]
+        return repository["pending"]["totalCount"] + repository["processing"]["totalCount"]
+
+    def _pending_candidates(self) -> Iterator[Issue]:
+        """Yield pending issues, oldest first: the mirror's jobs, then a page from the REST API"""
+        requester = self.repo._requester
+        if self.mirror is not None:
+            while (issue_data := self.mirror.claim()) is not None:
+                yield Issue(requester, {}, issue_data, completed=True)
+
+        headers, data = requester.requestJsonAndCheck(
+            "GET",
+            f"{self.repo.url}/issues",
+            parameters={
+                "labels": "pending",
+                "state": "open",
+                "sort": "created",
+                "direction": "asc",
+                "per_page": DEQUEUE_CANDIDATES,
+            },
+        )
+        for issue_data in data:
+            yield Issue(requester, headers, issue_data, completed=True)
+
+    @staticmethod
+    def _claim(issue: Issue) -> bool:
+        """Swap "pending" for "processing", unless another worker got there first"""
+        try:
             issue.remove_from_labels("pending")
+        except UnknownObjectException:
+            # GitHub only lets one DELETE of the label succeed
+            return False
+        try:
             issue.add_to_labels("processing")
+        except GithubException:
+            # Without either label no worker would ever see the job again
+            issue.add_to_labels("pending")
+            raise
+        return True
+
+    def dequeue(self, wait_sec: float | None = None) -> tuple[int, dict[str, Any]] | None:
+        """Get and claim next pending job
+
+        Workers racing for the same issue are told apart by removing its "pending"
+        label: GitHub answers 404 to all but the first, which move on to the next
+        candidate. This replaces sleeping before the lookup, which only made such
+        races less likely.
+
+        Args:
+            wait_sec: Deprecated and ignored, dequeue no longer sleeps before the lookup
+        """
+        if wait_sec is not None:
+            warnings.warn(
+                "dequeue(wait_sec=...) is deprecated and ignored, dequeue no longer sleeps",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+        try:
+            for issue in self._pending_candidates():
+                if self._claim(issue):
+                    return (issue.number, extract_json(issue.body))
 
-            return (issue.number, data)
+            self.logger.info(
+                "You tried to dequeue, but I couldn't find open issued that are labelled with 'pending'",
+            )
+            return None
 
         except GithubException as e:
-            self.logger.error(f"Failed to dequeue job: {e}")
+            self.logger.error("Failed to dequeue job: %s", e)
             raise
 
     def fail(self, job_id: int, comment: str = None) -> None:
@@ -145,14 +530,9 @@ class GithubQueue:
         if comment is None:
             comment = "This job has failed"
         try:
-            issue = self.repo.get_issue(job_id)
-            assert issue, f"Cannot find issue for {job_id}"
-            self._safe_remove_label(issue, "processing")
-            issue.add_to_labels("failed")
-            issue.create_comment(comment)
-            issue.edit(state="closed")
+            self._transition(self.repo.get_issue(job_id), {"processing"}, {"failed"}, "closed", comment)
         except GithubException as e:
-            self.logger.error(f"Failed to mark job {job_id} as failed: {e}")
+            self.logger.error("Failed to mark job %s as failed: %s", job_id, e)
             raise
 
     def create_comment(self, job_id: int, comment: str = None) -> None:
@@ -162,7 +542,7 @@ class GithubQueue:
             issue = self.repo.get_issue(job_id)
             issue.create_comment(comment)
         except GithubException as e:
-            self.logger.error(f"Failed to complete job {job_id}: {e}")
+            self.logger.error("Failed to complete job %s: %s", job_id, e)
             raise
 
     def complete(self, job_id: int, comment: str = None) -> None:
@@ -170,13 +550,9 @@ class GithubQueue:
         if comment is None:
             comment = "This has been completed, thank you"
         try:
-            issue = self.repo.get_issue(job_id)
-            self._safe_remove_label(issue, "processing")
-            issue.add_to_labels("completed")
-            issue.create_comment(comment)
-            issue.edit(state="closed")
+            self._transition(self.repo.get_issue(job_id), {"processing"}, {"completed"}, "closed", comment)
         except GithubException as e:
-            self.logger.error(f"Failed to complete job {job_id}: {e}")
+            self.logger.error("Failed to complete job %s: %s", job_id, e)
             raise
 
     def requeue(self, job_id: int, comment: str = None) -> None:
@@ -184,24 +560,10 @@ class GithubQueue:
         if comment is None:
             comment = "Job has been requeued for processing"
         try:
-            issue = self.repo.get_issue(job_id)
-
-            # Remove existing status labels
-            for label in ["processing", "completed"]:
-                self._safe_remove_label(issue, label)
-
-            # Add back to pending
-            issue.add_to_labels("pending")
-
-            # Reopen if closed
-            if issue.state == "closed":
-                issue.edit(state="open")
-
-            if comment:
-                issue.create_comment(comment)
-
+            # Swap the status labels back to pending and reopen if closed
+            self._transition(self.repo.get_issue(job_id), {"processing", "completed"}, {"pending"}, "open", comment)
         except GithubException as e:
-            self.logger.error(f"Failed to requeue job {job_id}: {e}")
+            self.logger.error("Failed to requeue job %s: %s", job_id, e)
             raise
 
     def get_job_status(self, job_id: int) -> str | None:
@@ -215,64 +577,158 @@ class GithubQueue:
             or None if the job doesn't exist
         """
         try:
-            issue = self.repo.get_issue(job_id)
-
-            # Get all labels for the issue
-            labels = [label.name for label in issue.get_labels()]
-
-            # Determine status based on labels and state
-            if issue.state == "closed":
-                if "completed" in labels:
-                    return "completed"
-                if "failed" in labels:
-                    return "failed"
-                return None  # Closed but not completed or failed
-            # Open issues
-            if "processing" in labels:
-                return "processing"
-            if "pending" in labels:
-                return "pending"
-            return None  # Open but not part of our queue
+            issue_state = self._get_issue_state(job_id)
+        except GithubException as e:
+            if e.status in (403, 429):
+                raise  # Rate limited, the job may well exist
+            return None  # Other GitHub API error
+        if issue_state is None:
+            return None  # Issue doesn't exist
+
+        state, labels = issue_state
+
+        # Determine status based on labels and state
+        if state == "closed":
+            if "completed" in labels:
+                return "completed"
+            if "failed" in labels:
+                return "failed"
+            return None  # Closed but not completed or failed
+        # Open issues
+        if "processing" in labels:
+            return "processing"
+        if "pending" in labels:
+            return "pending"
+        return None  # Open but not part of our queue
+
+    def _get_issue_state(self, job_id: int) -> tuple[str, frozenset[str]] | None:
+        """Get state and label names of an issue, revalidating a cached copy with its ETag
+
+        GitHub answers unchanged resources with 304 Not Modified, which doesn't count
+        against the rate limit.
 
-        except GithubException:
-            return None  # Issue doesn't exist or other GitHub API error
+        Returns:
+            Tuple of (state, label names), or None if the issue doesn't exist
+        """
+        url = f"{self.repo.url}/issues/{job_id}"
+        cached = self._etags.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        status, response_headers, output = self.repo._requester.requestJson("GET", url, headers=headers)
+
+        if status == 304 and cached:
+            return cached[1]
+        if status == 404:
+            return None
+        if status >= 400:
+            raise GithubException(status, output, response_headers)
+
+        issue = orjson.loads(output)
+        issue_state = (issue["state"], frozenset(label["name"] for label in issue["labels"]))
+        if "etag" in response_headers:
+            if len(self._etags) >= ETAG_CACHE_SIZE:
+                # Forget the oldest entry
+                del self._etags[next(iter(self._etags))]
+            self._etags[url] = (response_headers["etag"], issue_state)
+        return issue_state
 
     def get_jobs(
         self,
         labels: list[str] = ["processing"],
         state: Literal["open", "closed"] = "open",
+        include_start_time: bool = False,
     ) -> list[tuple[int, datetime, dict[str, Any]]]:
         """Get all jobs with specified labels
 
         Args:
             labels: List of label names to search for. Defaults to ["processing"]
             state: State of issues to fetch ("open" or "closed"). Defaults to "open"
+            include_start_time: Look up when the matching label was added, using GraphQL
+                queries of 100 jobs each. Defaults to False
 
         Returns:
             List of tuples containing (job_id, start_time, job_data)
-            where start_time is when the matching label was added
+            where start_time is when the matching label was added if include_start_time
+            is set, otherwise the time the issue was last updated. Earlier versions
+            always looked up the label; pass include_start_time=True to keep that
         """
         try:
-            issues = self.repo.get_issues(labels=labels, state=state)
+            if include_start_time:
+                return self._get_jobs_with_start_time(labels, state)
+
+            issues = self._list_issues({"labels": ",".join(labels), "state": state})
             jobs = []
 
             for issue in issues:
                 # Use extract_json instead of direct json parsing
-                data = extract_json(issue.body)
+                data = extract_json(issue["body"] or "")
                 if data is None:
                     continue
 
-                # Find when any of the matching labels was added by checking issue events
-                start_time = None
-                for event in issue.get_events():
-                    if event.event == "labeled" and event.label.name in labels:
-                        start_time = event.created_at
-                        break
-
-                jobs.append((issue.number, start_time, data))
+                updated_at = datetime.fromisoformat(issue["updated_at"].replace("Z", "+00:00"))
+                jobs.append((issue["number"], updated_at, data))
 
             return jobs
 
         except GithubException as e:
-            self.logger.error(f"Failed to get jobs with labels {labels}: {e}")
+            self.logger.error("Failed to get jobs with labels %s: %s", labels, e)
             raise
+
+    def _list_issues(self, parameters: dict[str, Any]) -> list[dict[str, Any]]:
+        """List issues as raw JSON, fetching all pages after the first concurrently
+
+        PyGithub's PaginatedList only requests the next page once the previous one is
+        consumed; the first page's Link header already names the last page.
+        """
+        requester = self.repo._requester
+        url = f"{self.repo.url}/issues"
+        parameters = {**parameters, "per_page": 100}
+
+        def fetch(page: int) -> list[dict[str, Any]]:
+            return requester.requestJsonAndCheck("GET", url, parameters={**parameters, "page": page})[1]
+
+        headers, issues = requester.requestJsonAndCheck("GET", url, parameters={**parameters, "page": 1})
+        match = _LAST_PAGE_RE.search(headers.get("link", ""))
+        if match:
+            for page in _PAGE_EXECUTOR.map(fetch, range(2, int(match.group(1)) + 1)):
+                issues.extend(page)
+        return issues
+
+    def _get_jobs_with_start_time(
+        self,
+        labels: list[str],
+        state: Literal["open", "closed"],
+    ) -> list[tuple[int, datetime, dict[str, Any]]]:
+        """Get jobs with their label times from GraphQL, 100 issues per request
+
+        Issue bodies, labels and label events come back in the same response, so no
+        request per issue is needed.
+        """
+        owner, name = self.repo.full_name.split("/", 1)
+        wanted = set(labels)
+        variables = {"owner": owner, "name": name, "labels": labels, "states": [state.upper()], "after": None}
+        jobs = []
+
+        while True:
+            _, result = self.repo._requester.graphql_query(_JOBS_QUERY, variables)
+            issues = result["data"]["repository"]["issues"]
+
+            for node in issues["nodes"]:
+                # GraphQL matches any of the labels, the REST API (and get_jobs) all of them
+                if not wanted <= {label["name"] for label in node["labels"]["nodes"]}:
+                    continue
+                data = extract_json(node["body"])
+                if data is None:
+                    continue
+
+                # Find when any of the matching labels was added
+                start_time = None
+                for event in node["timelineItems"]["nodes"]:
+                    if event["label"]["name"] in wanted:
+                        start_time = datetime.fromisoformat(event["createdAt"].replace("Z", "+00:00"))
+                        break
+
+                jobs.append((node["number"], start_time, data))
+
+            if not issues["pageInfo"]["hasNextPage"]:
+                return jobs
+            variables["after"] = issues["pageInfo"]["endCursor"]
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import sqlite3
+import threading
+from typing import Any
+import orjson
+from fastapi import APIRouter
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Request
+
+logger = logging.getLogger("octoqueue.webhook")
+
+# DELETE ... RETURNING claims a job in one statement, but needs SQLite 3.35
+_SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class JobMirror:
+    """Local SQLite copy of the open, pending issues of a queue
+
+    The table is fed by GitHub webhooks (see ``router``), so ``GithubQueue.dequeue``
+    can claim the next job without listing issues on GitHub. The database runs in
+    WAL mode and may be shared between the API process and several workers.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_jobs "
+            "(number INTEGER PRIMARY KEY, created TEXT NOT NULL, issue BLOB NOT NULL)",
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pending_jobs_created ON pending_jobs (created)")
+
+    def update(self, issue: dict[str, Any]) -> None:
+        """Store an issue while it is open and pending, forget it otherwise"""
+        labels = {label["name"] for label in issue.get("labels", [])}
+        with self._lock:
+            if issue["state"] == "open" and "pending" in labels:
+                self._conn.execute(
+                    "INSERT INTO pending_jobs (number, created, issue) VALUES (?, ?, ?) "
+                    "ON CONFLICT(number) DO UPDATE SET issue = excluded.issue",
+                    (issue["number"], issue["created_at"], orjson.dumps(issue)),
+                )
+            else:
+                self._conn.execute("DELETE FROM pending_jobs WHERE number = ?", (issue["number"],))
+
+    def claim(self) -> dict[str, Any] | None:
+        """Remove and return the oldest pending issue, or None if there is none"""
+        with self._lock:
+            if _SQLITE_HAS_RETURNING:
+                row = self._conn.execute(
+                    "DELETE FROM pending_jobs WHERE number = "
+                    "(SELECT number FROM pending_jobs ORDER BY created, number LIMIT 1) RETURNING issue",
+                ).fetchone()
+            else:
+                row = self._select_and_delete_oldest()
+        return orjson.loads(row[-1]) if row else None
+
+    def _select_and_delete_oldest(self) -> tuple[int, bytes] | None:
+        """Claim the oldest issue with a SELECT and a DELETE, for SQLite before 3.35"""
+        # Take the write lock up front, so no other process claims the same row
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT number, issue FROM pending_jobs ORDER BY created, number LIMIT 1",
+            ).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM pending_jobs WHERE number = ?", (row[0],))
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return row
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def verify_signature(body: bytes, secret: str, signature: str | None) -> bool:
+    """Check the X-Hub-Signature-256 header of a webhook delivery"""
+    if not signature:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+router = APIRouter()
+
+
+@router.post("/webhook/github", status_code=204)
+async def github_webhook(
+    request: Request,
+    x_github_event: str = Header(None),
+    x_hub_signature_256: str = Header(None),
+):
+    """Keep the job mirror up to date from GitHub ``issues`` events"""
+    mirror: JobMirror | None = getattr(request.app.state, "job_mirror", None)
+    secret = request.app.state.settings.webhook_secret if mirror is not None else None
+    if mirror is None or not secret:
+        raise HTTPException(status_code=404, detail="Webhook not configured")
+
+    body = await request.body()
+    if not verify_signature(body, secret, x_hub_signature_256):
+        logger.warning("Rejected webhook delivery with invalid signature")
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+    if x_github_event == "issues":
+        # SQLite writes block, keep them off the event loop
+        await asyncio.to_thread(mirror.update, orjson.loads(body)["issue"])
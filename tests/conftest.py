@@ -0,0 +1,101 @@
+"""Shared fixtures for the octoqueue tests."""
+
+from unittest.mock import Mock
+import pytest
+from github.Repository import Repository
+from github.Requester import Requester
+from octoqueue import GithubQueue
+from octoqueue.queue import REQUIRED_LABELS
+from .fakes import FakeRepo
+
+
+@pytest.fixture(scope="module")
+def _repo_mock():
+    """Build the repository mock once per module, see mock_repo"""
+    # Specs keep the mock from inventing attributes the real classes don't have
+    repo = Mock(spec=Repository)
+    repo._requester = Mock(spec=Requester)
+    return repo
+
+
+@pytest.fixture(scope="session")
+def github_etag_cache():
+    """Revalidate repeated GET requests to GitHub with their ETag
+
+    Answers of 304 Not Modified don't count against the rate limit; the cached
+    response is handed back as if GitHub had sent it again. Yields the cache,
+    keyed by URL and query parameters.
+    """
+    cache: dict[tuple[str, str], tuple[str, dict, str]] = {}
+    request_json = Requester.requestJson
+
+    def conditional_request_json(self, verb, url, parameters=None, headers=None, input=None, cnx=None):
+        # Leave requests alone that bring their own validator, like GithubQueue.get_job_status
+        if verb != "GET" or (headers and "If-None-Match" in headers):
+            return request_json(self, verb, url, parameters, headers, input, cnx)
+
+        key = (url, repr(sorted((parameters or {}).items())))
+        cached = cache.get(key)
+        if cached:
+            headers = {**(headers or {}), "If-None-Match": cached[0]}
+        status, response_headers, output = request_json(self, verb, url, parameters, headers, input, cnx)
+        if status == 304 and cached:
+            return 200, cached[1], cached[2]
+        if status == 200 and "etag" in response_headers:
+            cache[key] = (response_headers["etag"], response_headers, output)
+        return status, response_headers, output
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(Requester, "requestJson", conditional_request_json)
+        yield cache
+
+
+@pytest.fixture
+def mock_repo(_repo_mock, mocker, tmp_path):
+    """Create a mock repository, served by Github.get_repo"""
+    # Keep the labels cache of each test separate
+    mocker.patch("octoqueue.queue.LABELS_CACHE_DIR", tmp_path)
+    mocker.patch.object(GithubQueue, "_labels_ensured_repos", set())
+    mocker.patch.dict("os.environ", {"GH_TOKEN": "fake-token"})
+    mocker.patch("github.Github.get_repo", return_value=_repo_mock)
+
+    # Forget what earlier tests configured and called
+    mock = _repo_mock
+    mock.reset_mock(return_value=True, side_effect=True)
+    mock.get_labels.return_value = []
+
+    return mock
+
+
+@pytest.fixture
+def fake_repo(mocker, tmp_path):
+    """Create an in-memory repository, served by Github.get_repo"""
+    mocker.patch("octoqueue.queue.LABELS_CACHE_DIR", tmp_path)
+    mocker.patch.object(GithubQueue, "_labels_ensured_repos", set())
+    mocker.patch.dict("os.environ", {"GH_TOKEN": "fake-token"})
+    fake = FakeRepo()
+    mocker.patch("github.Github.get_repo", return_value=fake.repository)
+    return fake
+
+
+@pytest.fixture
+def gh_responses(mocker, tmp_path):
+    """Answer the GitHub REST API of test/repo at the HTTP layer
+
+    Unlike mock_repo, requests go through PyGithub's requester and responses are
+    parsed by its classes. The repository and its labels are registered, tests add
+    the endpoints they need.
+    """
+    responses = pytest.importorskip("responses")
+    mocker.patch("octoqueue.queue.LABELS_CACHE_DIR", tmp_path)
+    mocker.patch.object(GithubQueue, "_labels_ensured_repos", set())
+    mocker.patch.dict("os.environ", {"GH_TOKEN": "fake-token"})
+    # PyGithub spaces out requests to spare GitHub, not needed without network
+    mocker.patch.object(Requester, "_Requester__deferRequest")
+
+    # PyGithub sends the port along
+    url = "https://api.github.com:443/repos/test/repo"
+    with responses.RequestsMock() as rsps:
+        rsps.get(url, json={"url": "https://api.github.com/repos/test/repo", "full_name": "test/repo", "name": "repo"})
+        rsps.get(f"{url}/labels", json=[{"name": name, "color": color} for name, color in REQUIRED_LABELS.items()])
+        yield rsps
@@ -0,0 +1,228 @@
+"""In-memory stand-in for the GitHub API, for tests of the queue flows without HTTP."""
+
+import hashlib
+import itertools
+import re
+import threading
+from datetime import datetime
+from datetime import timezone
+from typing import Any
+from urllib.parse import parse_qsl
+from urllib.parse import unquote
+import orjson
+from github import UnknownObjectException
+from github.Repository import Repository
+
+API_URL = "https://api.github.com"
+_CLOSE_ISSUE_RE = re.compile(r'(\w+): closeIssue\(input: \{issueId: "(\w+)"\}\)')
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeRepo:
+    """A GitHub repository held in dicts, answering the requests PyGithub sends
+
+    GithubQueue reaches past the Repository and Issue objects to the requester
+    (raw issue listings, GraphQL, conditional GETs), so the fake plays the
+    requester and ``repository`` wraps it in a real PyGithub ``Repository``.
+    """
+
+    per_page = 30
+
+    def __init__(self, full_name: str = "ping13/octoqueue_test"):
+        self.url = f"{API_URL}/repos/{full_name}"
+        self.issues_by_number: dict[int, dict[str, Any]] = {}
+        self.labels: dict[str, str] = {}
+        self.comments: dict[int, list[str]] = {}
+        # Times a label was added, by issue number, for the GraphQL timeline
+        self.label_events: dict[int, list[tuple[str, str]]] = {}
+        self._numbers = itertools.count(1)
+        # The queue fetches pages from a thread pool
+        self._lock = threading.Lock()
+        self.repository = Repository(self, {}, {"url": self.url, "full_name": full_name}, completed=True)
+
+    # Requester interface
+
+    def check_me(self, obj) -> None:
+        pass
+
+    def requestJsonAndCheck(self, verb, url, parameters=None, headers=None, input=None):
+        url, _, query = url.partition("?")
+        parameters = {**dict(parse_qsl(query)), **(parameters or {})}
+        path = url.removeprefix(self.url).strip("/").split("/")
+        with self._lock:
+            headers, data = self._route(verb, path, parameters, input)
+            # Hand out copies, like JSON decoded from a response
+            return headers, orjson.loads(orjson.dumps(data))
+
+    def requestJson(self, verb, url, parameters=None, headers=None, input=None):
+        try:
+            _, data = self.requestJsonAndCheck(verb, url, parameters, headers, input)
+        except UnknownObjectException as e:
+            return e.status, {}, orjson.dumps(e.data).decode()
+        output = orjson.dumps(data)
+        etag = f'W/"{hashlib.sha1(output, usedforsecurity=False).hexdigest()}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return 304, {"etag": etag}, ""
+        return 200, {"etag": etag}, output.decode()
+
+    def graphql_query(self, query, variables):
+        with self._lock:
+            if "totalCount" in query:
+                counts = {
+                    label: {"totalCount": len(self._filter({"labels": label, "state": "open"}))}
+                    for label in ("pending", "processing")
+                }
+                return {}, {"data": {"repository": counts}}
+
+            if "closeIssue" in query:
+                closed = {}
+                for alias, issue_id in _CLOSE_ISSUE_RE.findall(query):
+                    self._issue(issue_id.removeprefix("I_"))["state"] = "closed"
+                    closed[alias] = {"issue": {"state": "CLOSED"}}
+                return {}, {"data": closed}
+
+            if "createIssue" in query:
+                names = [label_id.removeprefix("LA_") for label_id in variables["labelIds"]]
+                created = {}
+                i = 0
+                while f"title{i}" in variables:
+                    issue = self._create(
+                        {"title": variables[f"title{i}"], "body": variables[f"body{i}"], "labels": names},
+                    )
+                    created[f"j{i}"] = {"issue": {"number": issue["number"]}}
+                    i += 1
+                return {}, {"data": created}
+
+            if "issues(" not in query:
+                labels = [{"id": f"LA_{name}", "name": name} for name in self.labels]
+                return {}, {"data": {"repository": {"id": "R_fake", "labels": {"nodes": labels}}}}
+
+            if "timelineItems" not in query:
+                nodes = [{"id": issue["node_id"]} for issue in self._filter({"state": "open"})]
+                page_info = {"endCursor": None, "hasNextPage": False}
+                return {}, {"data": {"repository": {"issues": {"pageInfo": page_info, "nodes": nodes}}}}
+
+            # GraphQL matches issues carrying any of the labels
+            states = {state.lower() for state in variables["states"]}
+            wanted = set(variables["labels"])
+            nodes = [
+                {
+                    "number": issue["number"],
+                    "body": issue["body"],
+                    "labels": {"nodes": [{"name": label["name"]} for label in issue["labels"]]},
+                    "timelineItems": {
+                        "nodes": [
+                            {"createdAt": created, "label": {"name": name}}
+                            for created, name in self.label_events[issue["number"]]
+                        ],
+                    },
+                }
+                for issue in self.issues_by_number.values()
+                if issue["state"] in states and wanted & {label["name"] for label in issue["labels"]}
+            ]
+        page_info = {"endCursor": None, "hasNextPage": False}
+        return {}, {"data": {"repository": {"issues": {"pageInfo": page_info, "nodes": nodes}}}}
+
+    # Endpoints
+
+    def _route(self, verb, path, parameters, input):
+        match verb, path:
+            case "GET", ["labels"]:
+                return {}, [{"name": name, "color": color} for name, color in self.labels.items()]
+            case "POST", ["labels"]:
+                self.labels[input["name"]] = input["color"]
+                return {}, {"name": input["name"], "color": input["color"]}
+            case "GET", ["issues"]:
+                return self._list(parameters)
+            case "POST", ["issues"]:
+                return {}, self._create(input)
+            case "GET", ["issues", number]:
+                return {}, self._issue(number)
+            case "PATCH", ["issues", number]:
+                issue = self._issue(number)
+                if "labels" in input:
+                    self._set_labels(issue, input["labels"])
+                if "state" in input:
+                    issue["state"] = input["state"]
+                issue["updated_at"] = _now()
+                return {}, issue
+            case "POST", ["issues", number, "labels"]:
+                issue = self._issue(number)
+                self._set_labels(issue, [label["name"] for label in issue["labels"]] + list(input))
+                return {}, issue["labels"]
+            case "DELETE", ["issues", number, "labels", label]:
+                issue = self._issue(number)
+                names = [existing["name"] for existing in issue["labels"]]
+                if unquote(label) not in names:
+                    raise UnknownObjectException(404, {"message": "Label does not exist"}, {})
+                names.remove(unquote(label))
+                self._set_labels(issue, names)
+                return {}, issue["labels"]
+            case "POST", ["issues", number, "comments"]:
+                self.comments[self._issue(number)["number"]].append(input["body"])
+                return {}, {"body": input["body"]}
+        # A request the fake doesn't know is a test failure, not a missing feature
+        raise AssertionError(f"Unexpected GitHub request: {verb} {'/'.join(path)}")
+
+    def _issue(self, number) -> dict[str, Any]:
+        try:
+            return self.issues_by_number[int(number)]
+        except KeyError:
+            raise UnknownObjectException(404, {"message": "Not Found"}, {}) from None
+
+    def _create(self, input) -> dict[str, Any]:
+        number = next(self._numbers)
+        now = _now()
+        issue = {
+            "number": number,
+            "node_id": f"I_{number}",
+            "url": f"{self.url}/issues/{number}",
+            "title": input["title"],
+            "body": input.get("body"),
+            "state": "open",
+            "labels": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.issues_by_number[number] = issue
+        self.comments[number] = []
+        self.label_events[number] = []
+        self._set_labels(issue, input.get("labels", []))
+        return issue
+
+    def _set_labels(self, issue, names) -> None:
+        current = {label["name"] for label in issue["labels"]}
+        for name in dict.fromkeys(names):
+            if name not in current:
+                self.label_events[issue["number"]].append((_now(), name))
+        issue["labels"] = [{"name": name} for name in dict.fromkeys(names)]
+
+    def _filter(self, parameters) -> list[dict[str, Any]]:
+        wanted = set(filter(None, parameters.get("labels", "").split(",")))
+        state = parameters.get("state", "open")
+        return [
+            issue
+            for issue in self.issues_by_number.values()
+            if state in ("all", issue["state"]) and wanted <= {label["name"] for label in issue["labels"]}
+        ]
+
+    def _list(self, parameters):
+        issues = self._filter(parameters)
+        # GitHub lists the newest issues first unless asked otherwise
+        if parameters.get("direction", "desc") == "desc":
+            issues.reverse()
+
+        per_page = int(parameters.get("per_page", self.per_page))
+        page = int(parameters.get("page", 1))
+        last = max(1, -(-len(issues) // per_page))
+        headers = {}
+        if page < last:
+            query = "&".join(f"{key}={value}" for key, value in parameters.items() if key != "page")
+            headers["link"] = (
+                f'<{self.url}/issues?{query}&page={page + 1}>; rel="next", '
+                f'<{self.url}/issues?{query}&page={last}>; rel="last"'
+            )
+        return headers, issues[(page - 1) * per_page : page * per_page]
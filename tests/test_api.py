@@ -1,94 +1,151 @@
+import asyncio
+import hashlib
+import hmac
+import json
 from datetime import datetime
-from unittest.mock import MagicMock
-from unittest.mock import patch
+from datetime import timezone
+from types import SimpleNamespace
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from github import GithubException
+from starlette.datastructures import State
+from octoqueue.api import _background_tasks
+from octoqueue.api import _is_rate_limited
 from octoqueue.api import app
 from octoqueue.api import get_queue
+from octoqueue.api import settings
 from octoqueue.api import verify_api_key
-from octoqueue.queue import GithubQueue
 from octoqueue.queue import extract_json
+from octoqueue.webhook import JobMirror
 
 
-# Test client setup
-@pytest.fixture
+# Run the async tests on asyncio, with one event loop for the whole session
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+# Test client setup, with the app's lifespan run once for the whole session. The
+# settings may come from a developer's .env, so keep the lifespan from connecting
+# to a real repository or opening a real job database.
+@pytest.fixture(scope="session")
+async def aclient():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "github_repo", None)
+        mp.setattr(settings, "job_db", None)
+        async with (
+            app.router.lifespan_context(app),
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c,
+        ):
+            yield c
+
+
+# Synchronous client, kept for a smoke test of the TestClient path
+@pytest.fixture(scope="session")
 def client():
     return TestClient(app)
 
 
-# Mock GitHub issue
-@pytest.fixture
-def mock_issue():
-    issue = MagicMock()
-    issue.number = 123
-    issue.body = '```json\n{"test": "data"}\n```'
-    issue.state = "open"
+# The client is shared, so start every test with fresh rate-limit counters
+@pytest.fixture(autouse=True)
+def reset_rate_limits(monkeypatch):
+    monkeypatch.setattr("octoqueue.api.request_counts", {})
 
-    # Mock labels
-    label = MagicMock()
-    label.name = "pending"
-    issue.get_labels.return_value = [label]
 
-    # Mock events
-    event = MagicMock()
-    event.event = "labeled"
-    event.label.name = "pending"
-    event.created_at = datetime.now()
-    issue.get_events.return_value = [event]
+# create_job checks the topoprint cluster and pings it; answer both without a network
+@pytest.fixture(autouse=True)
+def stub_topoprint(monkeypatch):
+    async def cluster_available(client, topoprint_host):
+        return None
 
-    return issue
+    async def ping(topoprint_host, client):
+        return "scheduled"
 
+    monkeypatch.setattr(settings, "topoprint_host", "http://topoprint.test")
+    monkeypatch.setattr("octoqueue.api.check_cluster_status", cluster_available)
+    monkeypatch.setattr("octoqueue.api._bounded_ping_topoprint", ping)
 
-# Mock GitHub repo
-@pytest.fixture
-def mock_repo(mock_issue):
-    repo = MagicMock()
-    repo.get_issue.return_value = mock_issue
-    repo.create_issue.return_value = mock_issue
 
-    # Mock get_issues to return a list with our mock issue
-    issues_mock = MagicMock()
-    issues_mock.totalCount = 1
-    issues_mock.__iter__ = lambda self: iter([mock_issue])
-    issues_mock.__getitem__ = lambda self, idx: mock_issue
-    repo.get_issues.return_value = issues_mock
+# Fixed time for stubbed GitHub events, so the stubs are the same in every run
+LABELED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Recorder:
+    """Callable test double that records its calls, then returns or raises a fixed value"""
+
+    def __init__(self, return_value=None, side_effect=None):
+        self.return_value = return_value
+        self.side_effect = side_effect
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        if self.side_effect is not None:
+            raise self.side_effect
+        return self.return_value
+
+    def reset(self):
+        self.calls.clear()
 
-    # Mock labels
-    label = MagicMock()
-    label.name = "pending"
-    repo.get_labels.return_value = [label]
 
-    return repo
+# Stub GitHub issue, built once per module like the other stubs
+@pytest.fixture(scope="module")
+def mock_issue():
+    return SimpleNamespace(
+        number=123,
+        body='```json\n{"test": "data"}\n```',
+        state="open",
+        get_labels=Recorder([SimpleNamespace(name="pending")]),
+        get_events=Recorder(
+            [SimpleNamespace(event="labeled", label=SimpleNamespace(name="pending"), created_at=LABELED_AT)],
+        ),
+    )
+
+
+# Stub GitHub repo
+@pytest.fixture(scope="module")
+def mock_repo(mock_issue):
+    return SimpleNamespace(
+        get_issue=Recorder(mock_issue),
+        create_issue=Recorder(mock_issue),
+        get_issues=Recorder([mock_issue]),
+        get_labels=Recorder([SimpleNamespace(name="pending")]),
+    )
+
 
+# Stub queue, shared by the tests of this module
+@pytest.fixture(scope="module")
+def queue_stub(mock_repo):
+    return SimpleNamespace(repo=mock_repo, enqueue=Recorder(123))
 
-# Mock queue fixture
+
+# Stub queue fixture, with the calls of earlier tests forgotten
 @pytest.fixture
-def mock_queue(mock_repo):
-    with patch("octoqueue.queue.Github"), patch("octoqueue.queue.Auth"):
-        queue = MagicMock(spec=GithubQueue)
-        queue.repo = mock_repo
-        queue.enqueue.return_value = 123
+def mock_queue(queue_stub):
+    queue = queue_stub
+    queue.enqueue.reset()
 
-        # Override the dependency
-        app.dependency_overrides[get_queue] = lambda: queue
+    # Override the dependency
+    app.dependency_overrides[get_queue] = lambda: queue
 
-        yield queue
+    yield queue
 
-        # Clean up
-        app.dependency_overrides.clear()
+    # Clean up
+    app.dependency_overrides.pop(get_queue, None)
 
 
 # Mock API key for admin endpoints
 @pytest.fixture
-def mock_api_key():
-    with patch("octoqueue.api.API_KEY", "test-api-key"):
-        # Override API key validation
-        app.dependency_overrides[verify_api_key] = lambda x_api_key=None: "test-api-key"
+def mock_api_key(monkeypatch):
+    monkeypatch.setattr(settings, "api_key", "test-api-key")
+    # Override API key validation
+    app.dependency_overrides[verify_api_key] = lambda x_api_key=None: "test-api-key"
 
-        yield "test-api-key"
+    yield "test-api-key"
 
-        # Clean up
-        app.dependency_overrides.clear()
+    # Clean up
+    app.dependency_overrides.pop(verify_api_key, None)
 
 
 # Tests for health endpoint
@@ -101,7 +158,8 @@ def test_health_check(client):
 
 
 # Tests for create job endpoint
-def test_create_job(client, mock_queue):
+@pytest.mark.anyio
+async def test_create_job(aclient, mock_queue):
     # Test data
     job_data = {
         "data": {"key": "value"},
@@ -109,20 +167,19 @@ def test_create_job(client, mock_queue):
     }
 
     # Make request
-    response = client.post("/create-job", json=job_data)
+    response = await aclient.post("/create-job", json=job_data)
 
     # Assertions
     assert response.status_code == 201
     assert response.json() == {"job_id": 123, "processing_status": "scheduled", "status": "pending"}
-    mock_queue.enqueue.assert_called_once_with(
-        data=job_data["data"],
-        title=job_data["title"],
-        additional_labels=None,
-    )
+    assert mock_queue.enqueue.calls == [
+        ((), {"data": job_data["data"], "title": job_data["title"], "additional_labels": None}),
+    ]
 
 
 # Test with additional labels
-def test_create_job_with_additional_labels(client, mock_queue):
+@pytest.mark.anyio
+async def test_create_job_with_additional_labels(aclient, mock_queue):
     # Test data
     job_data = {
         "data": {"key": "value"},
@@ -131,58 +188,67 @@ def test_create_job_with_additional_labels(client, mock_queue):
     }
 
     # Make request
-    response = client.post("/create-job", json=job_data)
+    response = await aclient.post("/create-job", json=job_data)
 
     # Assertions
     assert response.status_code == 201
     assert response.json() == {"job_id": 123, "processing_status": "scheduled", "status": "pending"}
-    mock_queue.enqueue.assert_called_once_with(
-        data=job_data["data"],
-        title=job_data["title"],
-        additional_labels=job_data["additional_labels"],
-    )
+    assert mock_queue.enqueue.calls == [
+        (
+            (),
+            {
+                "data": job_data["data"],
+                "title": job_data["title"],
+                "additional_labels": job_data["additional_labels"],
+            },
+        ),
+    ]
 
 
 # Test schema validation
-def test_create_job_with_schema_validation(client, mock_queue):
+@pytest.mark.anyio
+async def test_create_job_with_schema_validation(aclient, mock_queue, monkeypatch):
     # Set a schema first
-    with patch("octoqueue.api.JOB_SCHEMA", {"type": "object", "required": ["name"]}):
-        # Valid job should pass
-        valid_job = {"data": {"name": "test"}, "title": "Valid Job"}
-        response = client.post("/create-job", json=valid_job)
-        assert response.status_code == 201
+    monkeypatch.setattr("octoqueue.api.JOB_SCHEMA", {"type": "object", "required": ["name"]})
 
-        # Invalid job should fail
-        invalid_job = {"data": {"not_name": "test"}, "title": "Invalid Job"}
-        response = client.post("/create-job", json=invalid_job)
-        assert response.status_code == 400
-        assert "does not match required schema" in response.json()["detail"]
+    # Valid job should pass
+    valid_job = {"data": {"name": "test"}, "title": "Valid Job"}
+    response = await aclient.post("/create-job", json=valid_job)
+    assert response.status_code == 201
+
+    # Invalid job should fail
+    invalid_job = {"data": {"not_name": "test"}, "title": "Invalid Job"}
+    response = await aclient.post("/create-job", json=invalid_job)
+    assert response.status_code == 400
+    assert "does not match required schema" in response.json()["detail"]
 
 
 # Test API key validation for admin endpoints
-def test_admin_schema_unauthorized(client):
+@pytest.mark.anyio
+async def test_admin_schema_unauthorized(aclient, monkeypatch):
     # No API key
-    response = client.post(
+    response = await aclient.post(
         "/admin/schema",
         json={"job_schema": {"type": "object"}},
     )
     assert response.status_code == 403
 
     # Wrong API key
-    with patch("octoqueue.api.API_KEY", "correct-key"):
-        response = client.post(
-            "/admin/schema",
-            json={"job_schema": {"type": "object"}},
-            headers={"X-API-Key": "wrong-key"},
-        )
-        assert response.status_code == 403
+    monkeypatch.setattr(settings, "api_key", "correct-key")
+    response = await aclient.post(
+        "/admin/schema",
+        json={"job_schema": {"type": "object"}},
+        headers={"X-API-Key": "wrong-key"},
+    )
+    assert response.status_code == 403
 
 
 # Test schema endpoints
-def test_set_job_schema(client, mock_api_key):
+@pytest.mark.anyio
+async def test_set_job_schema(aclient, mock_api_key):
     schema = {"type": "object", "properties": {"name": {"type": "string"}}}
 
-    response = client.post(
+    response = await aclient.post(
         "/admin/schema",
         json={"job_schema": schema},
         headers={"X-API-Key": mock_api_key},
@@ -192,52 +258,78 @@ def test_set_job_schema(client, mock_api_key):
     assert response.json() == {"status": "success", "message": "Schema updated successfully"}
 
 
-def test_get_job_schema(client, mock_api_key):
+@pytest.mark.anyio
+async def test_set_invalid_job_schema(aclient, mock_api_key):
+    response = await aclient.post(
+        "/admin/schema",
+        json={"job_schema": {"type": "not-a-type"}},
+        headers={"X-API-Key": mock_api_key},
+    )
+
+    assert response.status_code == 400
+    assert "Invalid JSON schema" in response.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_get_job_schema(aclient, mock_api_key, monkeypatch):
     # Set a schema for testing
-    with patch("octoqueue.api.JOB_SCHEMA", {"type": "object"}):
-        # Get the schema
-        response = client.get(
-            "/admin/schema",
-            headers={"X-API-Key": mock_api_key},
-        )
+    monkeypatch.setattr("octoqueue.api.JOB_SCHEMA", {"type": "object"})
 
-        assert response.status_code == 200
-        assert response.json() == {"job_schema": {"type": "object"}}
+    # Get the schema
+    response = await aclient.get(
+        "/admin/schema",
+        headers={"X-API-Key": mock_api_key},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"job_schema": {"type": "object"}}
 
 
 # Test rate limiting
-def test_rate_limiting(client, mock_queue):
+@pytest.mark.anyio
+async def test_rate_limiting(aclient, mock_queue, monkeypatch):
     # Patch the rate limit settings to make testing easier
-    with (
-        patch("octoqueue.api.RATE_LIMIT_REQUESTS", 2),
-        patch("octoqueue.api.RATE_LIMIT_WINDOW", 3600),
-        patch("octoqueue.api.request_counts", {}),
-    ):
-        # First request should succeed
-        response1 = client.post("/create-job", json={"data": {}, "title": "Job 1"})
-        assert response1.status_code == 201
+    monkeypatch.setattr(settings, "rate_limit_requests", 2)
+    monkeypatch.setattr(settings, "rate_limit_window", 3600)
 
-        # Second request should succeed
-        response2 = client.post("/create-job", json={"data": {}, "title": "Job 2"})
-        assert response2.status_code == 201
+    # First request should succeed
+    response1 = await aclient.post("/create-job", json={"data": {}, "title": "Job 1"})
+    assert response1.status_code == 201
 
-        # Third request should be rate limited
-        response3 = client.post("/create-job", json={"data": {}, "title": "Job 3"})
-        assert response3.status_code == 429
+    # Second request should succeed
+    response2 = await aclient.post("/create-job", json={"data": {}, "title": "Job 2"})
+    assert response2.status_code == 201
 
+    # Third request should be rate limited
+    response3 = await aclient.post("/create-job", json={"data": {}, "title": "Job 3"})
+    assert response3.status_code == 429
 
-# Test queue methods through API
-def test_queue_enqueue_error(client):
-    queue = MagicMock(spec=GithubQueue)
-    queue.enqueue.side_effect = Exception("Enqueue error")
 
-    app.dependency_overrides[get_queue] = lambda: queue
+def test_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_requests", 2)
+    monkeypatch.setattr(settings, "rate_limit_window", 60)
 
-    response = client.post("/create-job", json={"data": {}, "title": "Error Job"})
-    assert response.status_code == 500
-    assert "Failed to create job" in response.json()["detail"]
+    assert not _is_rate_limited("1.2.3.4", 0.0)
+    assert not _is_rate_limited("1.2.3.4", 1.0)
+    assert _is_rate_limited("1.2.3.4", 2.0)
+    # Other clients have their own window
+    assert not _is_rate_limited("5.6.7.8", 2.0)
+    # The first request left the window
+    assert not _is_rate_limited("1.2.3.4", 60.5)
 
-    app.dependency_overrides.clear()
+
+# Test queue methods through API
+@pytest.mark.anyio
+async def test_queue_enqueue_error(aclient, monkeypatch):
+    error = GithubException(500, {"message": "Server Error"}, {})
+    queue = SimpleNamespace(enqueue=Recorder(side_effect=error))
+
+    # Removed again after the test, even if an assertion fails
+    monkeypatch.setitem(app.dependency_overrides, get_queue, lambda: queue)
+
+    response = await aclient.post("/create-job", json={"data": {}, "title": "Error Job"})
+    assert response.status_code == 502
+    assert response.json()["detail"] == "GitHub API error"
 
 
 # Test extract_json function from queue module
@@ -247,6 +339,16 @@ def test_extract_json():
     result = extract_json(valid_text)
     assert result == {"key": "value"}
 
+    # Test with nested JSON in code block, as written by enqueue
+    nested_text = '```json\n{\n  "key": {"nested": [1, 2]}\n}\n```'
+    result = extract_json(nested_text)
+    assert result == {"key": {"nested": [1, 2]}}
+
+    # Test with backticks inside the JSON data
+    backtick_text = '```json\n{"code": "```inline```"}\n```'
+    result = extract_json(backtick_text)
+    assert result == {"code": "```inline```"}
+
     # Test with valid JSON without code block markers
     valid_json = '{"key": "value"}'
     result = extract_json(valid_json)
@@ -256,3 +358,48 @@ def test_extract_json():
     invalid_text = "Not JSON at all"
     result = extract_json(invalid_text)
     assert result is None
+
+
+@pytest.mark.anyio
+async def test_github_webhook_updates_job_mirror(aclient, tmp_path, monkeypatch):
+    """Test that signed issue events are mirrored and unsigned ones are rejected"""
+    mirror = JobMirror(str(tmp_path / "queue.db"))
+    monkeypatch.setattr(app.state, "job_mirror", mirror, raising=False)
+    monkeypatch.setattr(app.state, "settings", settings, raising=False)
+    monkeypatch.setattr(settings, "webhook_secret", "secret")
+
+    issue = {"number": 3, "created_at": "2024-01-01T00:00:00Z", "state": "open", "labels": [{"name": "pending"}]}
+    body = json.dumps({"action": "labeled", "issue": issue}).encode()
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+
+    response = await aclient.post("/webhook/github", content=body, headers={"X-GitHub-Event": "issues"})
+    assert response.status_code == 401
+
+    response = await aclient.post(
+        "/webhook/github",
+        content=body,
+        headers={"X-GitHub-Event": "issues", "X-Hub-Signature-256": signature},
+    )
+    assert response.status_code == 204
+    assert mirror.claim()["number"] == 3
+
+
+@pytest.mark.anyio
+async def test_shutdown_waits_for_background_tasks(monkeypatch):
+    """Test that the lifespan lets pings finish, and cancels those exceeding the timeout"""
+    # Run a lifespan of its own, without disturbing the session client's state
+    monkeypatch.setattr(app, "state", State())
+    monkeypatch.setattr(settings, "github_repo", None)
+    monkeypatch.setattr(settings, "job_db", None)
+    monkeypatch.setattr("octoqueue.api.BACKGROUND_TASKS_SHUTDOWN_TIMEOUT", 0.1)
+
+    async with app.router.lifespan_context(app):
+        quick = asyncio.create_task(asyncio.sleep(0.01))
+        slow = asyncio.create_task(asyncio.sleep(60))
+        for task in (quick, slow):
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    assert quick.done() and not quick.cancelled()
+    assert slow.cancelled()
+    assert app.state.http_client.is_closed
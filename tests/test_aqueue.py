@@ -0,0 +1,158 @@
+"""Tests for the octoqueue.aqueue module."""
+
+import asyncio
+import json
+from datetime import datetime
+from datetime import timezone
+import httpx
+import pytest
+from octoqueue.aqueue import AsyncGithubQueue
+
+
+def make_queue(handler):
+    """Create a queue whose HTTP requests are answered by handler"""
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="https://api.github.com")
+    return AsyncGithubQueue("test/repo", token="fake-token", client=client)
+
+
+def test_enqueue_with_additional_labels():
+    """Test that enqueue posts an issue with the pending and additional labels"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(201, json={"number": 7})
+
+    queue = make_queue(handler)
+    job_id = asyncio.run(queue.enqueue({"test": "data"}, additional_labels=["mastodon"]))
+
+    assert job_id == 7
+    assert requests[0].method == "POST"
+    assert requests[0].url.path == "/repos/test/repo/issues"
+    assert requests[0].headers["Authorization"] == "Bearer fake-token"
+    payload = json.loads(requests[0].content)
+    assert payload["labels"] == ["pending", "mastodon"]
+    assert payload["body"].startswith("```json\n")
+
+
+def test_dequeue_claims_oldest_pending_issue():
+    """Test that dequeue swaps pending for processing on the oldest pending issue"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.method == "GET":
+            return httpx.Response(200, json=[{"number": 3, "body": '```json\n{"a": 1}\n```'}])
+        return httpx.Response(200, json=[])
+
+    queue = make_queue(handler)
+    job = asyncio.run(queue.dequeue())
+
+    assert job == (3, {"a": 1})
+    assert requests[0].url.params["direction"] == "asc"
+    # Removing the pending label is the claim, then the job is marked as processing
+    calls = [(r.method, r.url.path) for r in requests[1:]]
+    assert calls == [
+        ("DELETE", "/repos/test/repo/issues/3/labels/pending"),
+        ("POST", "/repos/test/repo/issues/3/labels"),
+    ]
+
+
+def test_dequeue_restores_pending_label_when_claim_fails():
+    """Test that a job keeps its pending label if marking it as processing fails"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.method == "GET":
+            return httpx.Response(200, json=[{"number": 3, "body": '```json\n{"a": 1}\n```'}])
+        if request.method == "POST" and len(requests) == 3:
+            return httpx.Response(502, json={"message": "Bad Gateway"})
+        return httpx.Response(200, json=[])
+
+    queue = make_queue(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(queue.dequeue())
+
+    assert json.loads(requests[-1].content) == {"labels": ["pending"]}
+
+
+def test_dequeue_empty_queue():
+    """Test that dequeue returns None when nothing is pending"""
+    queue = make_queue(lambda request: httpx.Response(200, json=[]))
+    assert asyncio.run(queue.dequeue()) is None
+
+
+def test_complete_ignores_missing_processing_label():
+    """Test that completing a job tolerates a 404 when removing the processing label"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.method == "DELETE":
+            return httpx.Response(404, json={"message": "Label does not exist"})
+        return httpx.Response(200, json={})
+
+    queue = make_queue(handler)
+    asyncio.run(queue.complete(5, "done"))
+
+    calls = {(r.method, r.url.path) for r in requests}
+    assert calls == {
+        ("DELETE", "/repos/test/repo/issues/5/labels/processing"),
+        ("POST", "/repos/test/repo/issues/5/labels"),
+        ("PATCH", "/repos/test/repo/issues/5"),
+        ("POST", "/repos/test/repo/issues/5/comments"),
+    }
+
+
+def test_get_jobs_with_start_time():
+    """Test that get_jobs looks up when the matching label was added to each job, as a datetime"""
+
+    def handler(request):
+        if request.url.path == "/repos/test/repo/issues":
+            issues = [
+                {"number": n, "body": f'```json\n{{"n": {n}}}\n```', "updated_at": "2024-01-01T00:00:00Z"}
+                for n in (1, 2)
+            ]
+            return httpx.Response(200, json=issues)
+        number = int(request.url.path.split("/")[-2])
+        events = [
+            {"event": "labeled", "label": {"name": "pending"}, "created_at": "2024-01-01T00:00:00Z"},
+            {"event": "labeled", "label": {"name": "processing"}, "created_at": f"2024-01-0{number + 1}T00:00:00Z"},
+        ]
+        return httpx.Response(200, json=events)
+
+    queue = make_queue(handler)
+    jobs = asyncio.run(queue.get_jobs(include_start_time=True))
+
+    assert jobs == [
+        (1, datetime(2024, 1, 2, tzinfo=timezone.utc), {"n": 1}),
+        (2, datetime(2024, 1, 3, tzinfo=timezone.utc), {"n": 2}),
+    ]
+    assert asyncio.run(queue.get_jobs())[0] == (1, datetime(2024, 1, 1, tzinfo=timezone.utc), {"n": 1})
+
+
+def test_count_open_uses_one_graphql_request():
+    """Test that count_open adds up the totalCounts of a single GraphQL query"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        counts = {"pending": {"totalCount": 3}, "processing": {"totalCount": 2}}
+        return httpx.Response(200, json={"data": {"repository": counts}})
+
+    queue = make_queue(handler)
+
+    assert asyncio.run(queue.count_open()) == 5
+    assert [(r.method, r.url.path) for r in requests] == [("POST", "/graphql")]
+    assert json.loads(requests[0].content)["variables"] == {"owner": "test", "name": "repo"}
+
+
+def test_get_job_status_only_treats_404_as_missing():
+    """Test that a missing job has no status, while a rate limit raises"""
+    missing = make_queue(lambda request: httpx.Response(404, json={"message": "Not Found"}))
+    assert asyncio.run(missing.get_job_status(5)) is None
+
+    rate_limited = make_queue(lambda request: httpx.Response(429, json={"message": "rate limit exceeded"}))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(rate_limited.get_job_status(5))
@@ -0,0 +1,289 @@
+"""Tests of the octoqueue.queue flows, against an in-memory fake of GitHub and,
+with ``pytest -m integration``, the live GitHub test repository."""
+
+import os
+import time
+from pathlib import Path
+import pytest
+from octoqueue import GithubQueue
+from .fakes import FakeRepo
+
+# Longest time to wait for GitHub to reflect a change
+WAIT_SECONDS = 10
+
+# GitHub traffic of this module, recorded on the first run and replayed afterwards.
+# Record again with `make record-cassettes`; CI replays it with VCR_RECORD_MODE=none,
+# and only warns while no cassette has been committed.
+CASSETTE = Path(__file__).parent / "cassettes" / "test_integration.yaml"
+
+# Issues closed by one GraphQL mutation
+GRAPHQL_BATCH_SIZE = 100
+
+_OPEN_ISSUE_IDS_QUERY = """
+query($owner: String!, $name: String!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    issues(states: OPEN, first: 100, after: $after) {
+      pageInfo { endCursor hasNextPage }
+      nodes { id }
+    }
+  }
+}
+"""
+
+test_issue_data = {
+    "title": "Test Issue 😃",
+    "body": "Test Description, äöü, 世界 🌎",
+    "labels": ["bug"],
+}
+
+
+def _poll(fetch, done, timeout=WAIT_SECONDS, step=0.5):
+    """Call fetch until done(result) holds or the timeout passes, return the last result"""
+    deadline = time.monotonic() + timeout
+    result = fetch()
+    while not done(result) and time.monotonic() < deadline:
+        time.sleep(step)
+        result = fetch()
+    return result
+
+
+def _assert_count(queue, expected):
+    """Assert the number of open jobs, polling until GitHub reflects earlier changes"""
+    assert _poll(queue.count_open, lambda cnt: cnt == expected) == expected
+
+
+def _close_all_open_issues(queue):
+    """Close all open issues to have a safe state to run the tests in
+
+    One GraphQL query per 100 open issues finds their node IDs, one aliased
+    mutation per 100 issues closes them.
+    """
+    requester = queue.repo._requester
+    owner, name = queue.repo.full_name.split("/", 1)
+    variables = {"owner": owner, "name": name, "after": None}
+    issue_ids = []
+    while True:
+        _, result = requester.graphql_query(_OPEN_ISSUE_IDS_QUERY, variables)
+        issues = result["data"]["repository"]["issues"]
+        issue_ids.extend(node["id"] for node in issues["nodes"])
+        if not issues["pageInfo"]["hasNextPage"]:
+            break
+        variables["after"] = issues["pageInfo"]["endCursor"]
+
+    states = []
+    for start in range(0, len(issue_ids), GRAPHQL_BATCH_SIZE):
+        mutations = " ".join(
+            f'c{i}: closeIssue(input: {{issueId: "{issue_id}"}}) {{ issue {{ state }} }}'
+            for i, issue_id in enumerate(issue_ids[start : start + GRAPHQL_BATCH_SIZE])
+        )
+        _, result = requester.graphql_query(f"mutation {{ {mutations} }}", {})
+        states.extend(payload["issue"]["state"] for payload in result["data"].values())
+
+    assert states == ["CLOSED"] * len(issue_ids)
+
+
+@pytest.fixture(scope="session")
+def cassette():
+    """Record or replay all live GitHub requests, in order"""
+    vcr = pytest.importorskip("vcr")
+    with vcr.use_cassette(
+        str(CASSETTE),
+        record_mode=os.getenv("VCR_RECORD_MODE", "once"),
+        # GraphQL requests only differ in their body
+        match_on=["method", "scheme", "host", "port", "path", "query", "body"],
+        filter_headers=["authorization"],
+    ) as cassette:
+        yield cassette
+
+
+@pytest.fixture(scope="session")
+def live_queue(cassette, github_etag_cache, tmp_path_factory):
+    """Setup the queue on the live repository once, the tests share its client
+
+    Open issues are closed before the first and after the last test; in between,
+    each test closes the jobs it created.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        # Check the labels inside the cassette on every run, not only when no cache is left
+        mp.setattr("octoqueue.queue.LABELS_CACHE_DIR", tmp_path_factory.mktemp("labels"))
+        mp.setattr(GithubQueue, "_labels_ensured_repos", set())
+        # Replaying needs no real token
+        token = "cassette-replay" if cassette.write_protected else None
+        queue = GithubQueue(os.getenv("OCTOQUEUE_TEST_REPO", "ping13/octoqueue_test"), token=token)
+        _close_all_open_issues(queue)
+        yield queue
+        _close_all_open_issues(queue)
+
+
+@pytest.fixture(
+    params=[
+        "fake",
+        # Tests on the live repository see each other's issues, keep them in one xdist worker
+        pytest.param("live", marks=[pytest.mark.integration, pytest.mark.xdist_group("github_live")]),
+    ],
+)
+def queue(request, tmp_path, monkeypatch):
+    """Setup a queue on an empty repository, a new fake one or the live one"""
+    if request.param == "live":
+        return request.getfixturevalue("live_queue")
+
+    monkeypatch.setattr("octoqueue.queue.LABELS_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(GithubQueue, "_labels_ensured_repos", set())
+    monkeypatch.setattr("github.Github.get_repo", lambda gh, name: FakeRepo(name).repository)
+    return GithubQueue("ping13/octoqueue_test", token="fake-token")
+
+
+@pytest.fixture
+def fresh_job(queue, request):
+    """Enqueue a job for one test and complete it afterwards if the test left it open"""
+    # A fixed title keeps the request body, and thus the cassette, the same on every run
+    job_id = queue.enqueue(test_issue_data, f"Fresh Job {request.node.name}")
+    yield job_id, test_issue_data
+    if queue.get_job_status(job_id) in ("pending", "processing"):
+        queue.complete(job_id)
+
+
+def test_close_all_open_issues(queue):
+    """Test that the cleanup helper closes every open job"""
+    queue.enqueue({"test": "cleanup"}, "Cleanup Test")
+    queue.enqueue({"test": "cleanup"}, "Cleanup Test", additional_labels=["mastodon"])
+
+    _close_all_open_issues(queue)
+    _assert_count(queue, 0)
+
+
+def test_full_lifecycle(queue, fresh_job):
+    """Walk one job through every state of the queue
+
+    The open-job count is read once at the start; the job leaves the count only when
+    it is closed, so a single recount at the end covers the whole sequence.
+    """
+    job_id, data = fresh_job
+    cnt0 = queue.count_open()
+    assert cnt0 >= 1
+    assert queue.get_job_status(job_id) == "pending"
+
+    # Process it
+    assert queue.dequeue() == (job_id, data)
+    assert job_id in [proc_id for proc_id, _, _ in queue.get_jobs(labels=["processing"])]
+    assert queue.get_job_status(job_id) == "processing"
+
+    # Complete it
+    queue.complete(job_id)
+    assert queue.get_job_status(job_id) == "completed"
+
+    # Requeue it and process it again
+    queue.requeue(job_id, "Requeuing for test")
+    assert queue.get_job_status(job_id) == "pending"
+    assert queue.dequeue() == (job_id, data)
+
+    # Fail it
+    queue.fail(job_id, "Test failure message")
+    assert queue.get_job_status(job_id) == "failed"
+    _assert_count(queue, cnt0 - 1)
+
+
+def test_get_jobs(queue):
+    """Test getting list of jobs with different labels"""
+    # First ensure we have a processing job and a job with custom label
+    job1_id = queue.enqueue({"test": "processing_check"}, "Processing Job Test")
+    job2_id = queue.enqueue(
+        {"test": "custom_label_check"},
+        "Custom Label Test",
+        additional_labels=["mastodon"],
+    )
+
+    # Get count of open issues
+    _assert_count(queue, 2)
+
+    # Dequeue first job to mark it as processing
+    job = queue.dequeue()
+    assert job == (job1_id, {"test": "processing_check"}), "the oldest open job was not dequeued first"
+
+    # Get count of open issues
+    _assert_count(queue, 2)
+
+    # Test getting only processing jobs
+    processing = queue.get_jobs()  # default label="processing"
+    assert len(processing) >= 1
+
+    # Verify the structure of returned data for processing jobs
+    found_processing = False
+    for proc_id, start_time, data in processing:
+        if proc_id == job1_id:
+            found_processing = True
+            assert start_time is not None
+            assert isinstance(data, dict)
+            assert data["test"] == "processing_check"
+
+    assert found_processing, "Recently created processing job not found"
+
+    # Test getting jobs with custom label, the only job carrying the additional label
+    custom_labeled = queue.get_jobs(labels=["mastodon"])
+    assert len(custom_labeled) == 1
+
+    # Verify the structure of returned data for custom labeled jobs
+    found_custom = False
+    for proc_id, start_time, data in custom_labeled:
+        if proc_id == job2_id:
+            found_custom = True
+            assert start_time is not None
+            assert isinstance(data, dict)
+            assert data["test"] == "custom_label_check"
+
+    assert found_custom, "Recently created custom labeled job not found"
+
+    # Cleanup
+    queue.complete(job1_id)
+    queue.complete(job2_id)
+
+
+def test_fifo_order(queue):
+    """Test that dequeue follows FIFO (First In, First Out) order"""
+    # Create three test jobs in sequence, with a single request
+    job1_data = {"test": "fifo1"}
+    job2_data = {"test": "fifo2"}
+    job3_data = {"test": "fifo3"}
+
+    job1_id, job2_id, job3_id = queue.enqueue_many(
+        [job1_data, job2_data, job3_data],
+        ["FIFO Test 1", "FIFO Test 2", "FIFO Test 3"],
+    )
+    _assert_count(queue, 3)
+
+    # Dequeue them in sequence and verify order
+    assert queue.dequeue() == (job1_id, job1_data)
+    assert queue.dequeue() == (job2_id, job2_data)
+    assert queue.dequeue() == (job3_id, job3_data)
+
+    # Clean up
+    queue.complete(job1_id)
+    queue.complete(job2_id)
+    queue.complete(job3_id)
+
+
+def test_get_job_status(queue, fresh_job):
+    """Test getting the status of jobs in different states"""
+    pending_job_id, job_data = fresh_job
+    assert queue.get_job_status(pending_job_id) == "pending"
+
+    # Get a job for processing
+    queue.dequeue()  # Process the pending job
+
+    # Create and complete a job
+    completed_job_id = queue.enqueue(job_data, "Status Test - To Complete")
+    queue.dequeue()  # Mark as processing
+    queue.complete(completed_job_id)
+
+    # Create and fail a job
+    failed_job_id = queue.enqueue(job_data, "Status Test - To Fail")
+    queue.dequeue()  # Mark as processing
+    queue.fail(failed_job_id)
+
+    # Test status for each job
+    assert queue.get_job_status(pending_job_id) == "processing"  # First job is now processing
+    assert queue.get_job_status(completed_job_id) == "completed"
+    assert queue.get_job_status(failed_job_id) == "failed"
+
+    # Test non-existent job
+    assert queue.get_job_status(99999) is None
@@ -1,284 +1,539 @@
 """Tests for the octoqueue.queue module."""
 
-import unittest
+import time
+from types import SimpleNamespace
+import orjson
 import pytest
+from github import GithubException
+from github import RateLimitExceededException
+from github import UnknownObjectException
+from github.Issue import Issue
+from octoqueue import EnqueueManyError
 from octoqueue import GithubQueue
+from octoqueue import extract_json
+from octoqueue.queue import _labels_cache_path
+from octoqueue.queue import _read_labels_cache
+from octoqueue.queue import _write_labels_cache
+from octoqueue.webhook import JobMirror
+
+# URL of the repository answered by gh_responses
+REPO_URL = "https://api.github.com:443/repos/test/repo"
+
+
+def _issue_json(number, labels, state="open"):
+    """GitHub's answer for an issue, as far as the queue reads it"""
+    return {
+        "number": number,
+        "url": f"https://api.github.com/repos/test/repo/issues/{number}",
+        "state": state,
+        "labels": [{"name": name} for name in labels],
+    }
+
+
+@pytest.mark.parametrize(
+    ("additional_labels", "expected"),
+    [
+        (None, ["pending"]),
+        (["mastodon", "custom-label"], ["pending", "mastodon", "custom-label"]),
+    ],
+)
+def test_enqueue_labels(gh_responses, additional_labels, expected):
+    """Test that enqueue labels the issue pending, plus any additional labels"""
+    gh_responses.post(f"{REPO_URL}/issues", json={"number": 1}, status=201)
+    queue = GithubQueue("test/repo")
+    test_data = {"test": "data"}
+
+    assert queue.enqueue(test_data, additional_labels=additional_labels) == 1
+
+    request_body = orjson.loads(gh_responses.calls[-1].request.body)
+    assert request_body["labels"] == expected
+    assert extract_json(request_body["body"]) == test_data
+
+
+def test_complete_updates_labels_and_state_in_one_edit(mock_repo, mocker):
+    """Test that completing a job swaps labels and closes the issue with a single edit"""
+    issue = mocker.Mock(spec_set=Issue, state="open")
+    issue.labels = [SimpleNamespace(name="processing"), SimpleNamespace(name="mastodon")]
+    mock_repo.get_issue.return_value = issue
+
+    queue = GithubQueue("test/repo")
+    queue.complete(42, "done")
+
+    mock_repo.get_issue.assert_called_once_with(42)
+    issue.edit.assert_called_once()
+    call_args = issue.edit.call_args[1]
+    assert set(call_args["labels"]) == {"completed", "mastodon"}
+    assert call_args["state"] == "closed"
+    issue.create_comment.assert_called_once_with("done")
+
+
+def test_complete_does_not_comment_when_update_fails(mock_repo, mocker):
+    """Test that a failed issue update leaves the job without a completion comment"""
+    issue = mocker.Mock(spec_set=Issue, state="open")
+    issue.labels = [SimpleNamespace(name="processing")]
+    issue.edit.side_effect = GithubException(502, {"message": "Server Error"}, {})
+    mock_repo.get_issue.return_value = issue
+
+    queue = GithubQueue("test/repo")
+    with pytest.raises(GithubException):
+        queue.complete(42, "done")
+
+    issue.create_comment.assert_not_called()
+
+
+def test_requeue_pending_job_only_comments(mock_repo, mocker):
+    """Test that requeueing a job that is already pending and open skips the issue update"""
+    issue = mocker.Mock(spec_set=Issue, state="open")
+    issue.labels = [SimpleNamespace(name="pending")]
+    mock_repo.get_issue.return_value = issue
+
+    queue = GithubQueue("test/repo")
+    queue.requeue(42)
+
+    issue.edit.assert_not_called()
+    issue.create_comment.assert_called_once_with("Job has been requeued for processing")
+
+
+def test_labels_are_ensured_once_per_repo(mock_repo):
+    """Test that a second queue for the same repository skips the label check"""
+    mock_repo.full_name = "test/labels-once"
+
+    GithubQueue("test/labels-once")
+    GithubQueue("test/labels-once")
+
+    mock_repo.get_labels.assert_called_once()
+    assert mock_repo.create_label.call_count == 5
+
+
+def test_labels_cache_is_shared_between_processes(mock_repo):
+    """Test that a fresh process reuses the labels cache written by an earlier one"""
+    mock_repo.full_name = "test/labels-cache"
+
+    GithubQueue("test/labels-cache")
+    # Simulate a new process: the in-memory record is gone, the cache file remains
+    GithubQueue._labels_ensured_repos.clear()
+    GithubQueue("test/labels-cache")
+
+    mock_repo.get_labels.assert_called_once()
+
+
+def test_labels_cache_write_does_not_follow_symlinks(tmp_path, monkeypatch):
+    """Test that the labels cache replaces a symlink at its path instead of writing through it"""
+    monkeypatch.setattr("octoqueue.queue.LABELS_CACHE_DIR", tmp_path / "cache")
+    victim = tmp_path / "victim"
+    victim.write_text("keep")
+    path = _labels_cache_path("test/repo")
+    path.parent.mkdir()
+    path.symlink_to(victim)
+
+    _write_labels_cache(path, {"pending"})
+
+    assert victim.read_text() == "keep"
+    assert not path.is_symlink()
+    assert _read_labels_cache(path) == {"pending"}
+    assert [p.name for p in path.parent.iterdir()] == [path.name]
+
+
+def test_labels_cache_is_skipped_without_a_home(mock_repo, mocker):
+    """Test that the queue checks the labels itself when there is no directory for the cache"""
+    mocker.patch("octoqueue.queue.LABELS_CACHE_DIR", None)
+    mocker.patch.dict("os.environ", {"XDG_CACHE_HOME": ""})
+    mocker.patch("pathlib.Path.home", side_effect=RuntimeError("Could not determine home directory."))
 
-WAIT_SECONDS = 10
-
-
-@pytest.fixture
-def mock_repo(mocker):
-    """Create a mock repository"""
-    mock = mocker.Mock()
-    mock.get_labels.return_value = []
-    mock.create_label = mocker.Mock()
-    mock.create_issue = mocker.Mock()
-
-    # Mock Github client
-    mocker.patch("github.Github.get_repo", return_value=mock)
-    # Mock environment variable
-    mocker.patch("os.getenv", return_value="fake-token")
-
-    return mock
-
-
-test_issue_data = {
-    "title": "Test Issue 😃",
-    "body": "Test Description, äöü, 世界 🌎",
-    "labels": ["bug"],
-}
-
-
-class TestGitHubQueue(unittest.TestCase):
-    def setUp(self):
-        """Setup the queue"""
-        self.queue = GithubQueue("ping13/octoqueue_test")
-
-    def _close_all_open_issues(self):
-        """Helper method to close all open issues before doing the tests to
-        clean up and have safe state to run a test
-        """
-        open_issues = self.queue.repo.get_issues(state="open")
-
-        if open_issues:
-            for issue in open_issues:
-                issue.edit(state="closed")
-
-        # Verify queue is empty
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.assertEqual(cnt, 0, "Failed to clean up pending jobs")
-        print("all issues are closed")
-
-    def test_01_add_issue(self):
-        """Test adding an issue to the queue."""
-        self._close_all_open_issues()
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        print(f"cnt = {cnt}")
-        self.assertTrue(cnt == 0, "count is supposed to be zero after closing all open issues")
-        TestGitHubQueue.job_id = self.queue.enqueue(test_issue_data)
-        print(f"job_id = {self.job_id}")
-        self.assertTrue(self.job_id > 0)
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.assertEqual(cnt, 1)
-
-    def test_02_process_issue(self):
-        """Get the job from the queue"""
-        # no clean up as it relies on test_01_add_issue
-        job = self.queue.dequeue()
-        self.assertTrue(isinstance(job, tuple))
-        this_job_id, data = job
-        self.assertEqual(this_job_id, TestGitHubQueue.job_id)
-        self.assertTrue(isinstance(data, dict))
-
-    def test_03_complete_issue(self):
-        """Complete a job from the queue"""
-        # no clean up as it relies on test_01_process_issue
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.queue.complete(TestGitHubQueue.job_id)
-        self.assertEqual(self.queue.count_open(wait_sec=WAIT_SECONDS), cnt - 1)
-
-    def test_04_requeue_issue(self):
-        """Test requeuing a completed job"""
-        # no clean up as it relies on test_03_complete_issue
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.queue.requeue(TestGitHubQueue.job_id, "Requeuing for test")
-        self.assertEqual(self.queue.count_open(wait_sec=WAIT_SECONDS), cnt + 1)
-
-        # Verify it's back in pending state
-        job = self.queue.dequeue()
-        self.assertIsNotNone(job)
-        job_id, data = job
-        self.assertEqual(job_id, TestGitHubQueue.job_id)
-        self.assertEqual(data, test_issue_data)
-
-    def test_05_complete_requeued_issue(self):
-        """Complete a job from the queue"""
-        # no clean up as it relies on test_04_requeue_issue
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.queue.complete(TestGitHubQueue.job_id)
-        self.assertEqual(self.queue.count_open(wait_sec=WAIT_SECONDS), cnt - 1)
-
-    def test_06_get_jobs(self):
-        """Test getting list of jobs with different labels"""
-        self._close_all_open_issues()
-        # First ensure we have a processing job and a job with custom label
-        job1_id = self.queue.enqueue({"test": "processing_check"}, "Processing Job Test")
-        job2_id = self.queue.enqueue(
-            {"test": "custom_label_check"},
-            "Custom Label Test",
-            additional_labels=["mastodon"],
+    assert _labels_cache_path("test/repo") is None
+    GithubQueue("test/repo")
+    mock_repo.get_labels.assert_called_once()
+
+
+def test_dequeue_claims_oldest_pending_issue(mock_repo):
+    """Test that dequeue lists the oldest pending issues and claims the first one"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    requester = mock_repo._requester
+    issue_data = {
+        "number": 4,
+        "url": "https://api.github.com/repos/test/repo/issues/4",
+        "body": '```json\n{"test": "data"}\n```',
+        "state": "open",
+        "labels": [{"name": "pending"}, {"name": "mastodon"}],
+    }
+    requester.requestJsonAndCheck.return_value = ({}, [issue_data])
+
+    queue = GithubQueue("test/repo")
+    job = queue.dequeue()
+
+    assert job == (4, {"test": "data"})
+    verb, url = requester.requestJsonAndCheck.call_args_list[0][0]
+    parameters = requester.requestJsonAndCheck.call_args_list[0][1]["parameters"]
+    assert (verb, url) == ("GET", "https://api.github.com/repos/test/repo/issues")
+    assert parameters["direction"] == "asc"
+
+    # Removing the pending label is the claim, then the job is marked as processing
+    calls = [(c[0][0], c[0][1]) for c in requester.requestJsonAndCheck.call_args_list[1:]]
+    assert calls == [("DELETE", f"{issue_data['url']}/labels/pending"), ("POST", f"{issue_data['url']}/labels")]
+
+
+def test_dequeue_skips_issue_claimed_by_another_worker(mock_repo):
+    """Test that dequeue moves on when another worker removed the pending label first"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    issues = [
+        {
+            "number": n,
+            "url": f"https://api.github.com/repos/test/repo/issues/{n}",
+            "body": f'```json\n{{"job": {n}}}\n```',
+            "labels": [{"name": "pending"}],
+        }
+        for n in (1, 2)
+    ]
+
+    def request(verb, url, **kwargs):
+        if verb == "GET":
+            return {}, issues
+        if verb == "DELETE" and url.endswith("/issues/1/labels/pending"):
+            raise UnknownObjectException(404, {"message": "Label does not exist"}, {})
+        return {}, []
+
+    mock_repo._requester.requestJsonAndCheck.side_effect = request
+
+    queue = GithubQueue("test/repo")
+
+    assert queue.dequeue() == (2, {"job": 2})
+
+
+def test_dequeue_restores_pending_label_when_claim_fails(gh_responses):
+    """Test that a job keeps its pending label if marking it as processing fails"""
+    issue = {**_issue_json(7, ["pending"]), "body": '```json\n{"job": 7}\n```'}
+    gh_responses.get(f"{REPO_URL}/issues", json=[issue])
+    gh_responses.delete(f"{REPO_URL}/issues/7/labels/pending", json=[])
+    gh_responses.post(f"{REPO_URL}/issues/7/labels", status=502, json={"message": "Bad Gateway"})
+    gh_responses.post(f"{REPO_URL}/issues/7/labels", json=[{"name": "pending"}])
+
+    queue = GithubQueue("test/repo")
+    with pytest.raises(GithubException):
+        queue.dequeue()
+
+    assert orjson.loads(gh_responses.calls[-1].request.body) == ["pending"]
+
+
+def test_dequeue_wait_sec_is_deprecated(mock_repo, mocker):
+    """Test that dequeue still accepts wait_sec, warns about it and doesn't sleep"""
+    mock_repo._requester.requestJsonAndCheck.return_value = ({}, [])
+    sleep = mocker.patch("time.sleep")
+
+    queue = GithubQueue("test/repo")
+    with pytest.warns(DeprecationWarning, match="wait_sec"):
+        assert queue.dequeue(wait_sec=5) is None
+    sleep.assert_not_called()
+
+
+def test_dequeue_claims_from_mirror(mock_repo, tmp_path):
+    """Test that dequeue takes the oldest job from the webhook mirror without listing issues"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    requester = mock_repo._requester
+    requester.requestJsonAndCheck.return_value = ({}, {})
+    mirror = JobMirror(str(tmp_path / "queue.db"))
+    for number, created in [(7, "2024-01-02T00:00:00Z"), (5, "2024-01-01T00:00:00Z")]:
+        mirror.update(
+            {
+                "number": number,
+                "url": f"https://api.github.com/repos/test/repo/issues/{number}",
+                "created_at": created,
+                "body": f'```json\n{{"job": {number}}}\n```',
+                "state": "open",
+                "labels": [{"name": "pending"}],
+            },
         )
 
-        # Get count of open issues
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.assertEqual(cnt, 2)
-
-        # Dequeue first job to mark it as processing
-        job = self.queue.dequeue()
-        self.assertIsNotNone(job, f"first job is unknown although cnt={cnt}")
-        print(job)
-
-        # Get count of open issues
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.assertEqual(cnt, 2)
-
-        # Test getting only processing jobs
-        processing = self.queue.get_jobs()  # default label="processing"
-        print(list(processing))
-        self.assertTrue(len(list(processing)) >= 1)
-
-        # Verify the structure of returned data for processing jobs
-        found_processing = False
-        for proc_id, start_time, data in processing:
-            if proc_id == job1_id:
-                found_processing = True
-                self.assertIsNotNone(start_time)
-                self.assertIsInstance(data, dict)
-                self.assertEqual(data["test"], "processing_check")
-
-        self.assertTrue(found_processing, "Recently created processing job not found")
-
-        # Test getting jobs with custom label
-        custom_labeled = self.queue.get_jobs(labels=["mastodon"])
-        self.assertTrue(len(custom_labeled) >= 1)
-
-        # Verify the structure of returned data for custom labeled jobs
-        found_custom = False
-        for proc_id, start_time, data in custom_labeled:
-            if proc_id == job2_id:
-                found_custom = True
-                self.assertIsNotNone(start_time)
-                self.assertIsInstance(data, dict)
-                self.assertEqual(data["test"], "custom_label_check")
-
-        self.assertTrue(found_custom, "Recently created custom labeled job not found")
-
-        # Test getting jobs with the additional label
-        mastodon_labeled = self.queue.get_jobs(labels=["mastodon"])
-        self.assertTrue(len(mastodon_labeled) == 1)
-
-        # Cleanup
-        self.queue.complete(job1_id)
-        self.queue.complete(job2_id)
-
-    def test_07_fail_issue(self):
-        """Test marking a job as failed"""
-        self._close_all_open_issues()
-        # Create a new job to test failure
-        job_id = self.queue.enqueue({"test": "failure_test"}, "Failure Test Job")
-
-        # Get count of open issues
-        cnt = self.queue.count_open(wait_sec=WAIT_SECONDS)
-        self.assertEqual(cnt, 1)
-
-        job = self.queue.dequeue()  # Mark it as processing
-        self.assertIsNotNone(job)
-
-        # Mark the job as failed
-        failure_message = "Test failure message"
-        self.queue.fail(job_id, failure_message)
-
-        # Verify open count decreased
-        self.assertEqual(self.queue.count_open(wait_sec=WAIT_SECONDS), cnt - 1)
-
-        # Could add more detailed verification here if needed, such as:
-        # - Verify the failure label is present
-        # - Verify the failure message was added as a comment
-        # - Verify the issue is closed
-
-    def test_08_fifo_order(self):
-        """Test that dequeue follows FIFO (First In, First Out) order"""
-        self._close_all_open_issues()
-
-        # Create three test jobs in sequence
-        job1_data = {"test": "fifo1"}
-        job2_data = {"test": "fifo2"}
-        job3_data = {"test": "fifo3"}
-
-        job1_id = self.queue.enqueue(job1_data, "FIFO Test 1")
-        job2_id = self.queue.enqueue(job2_data, "FIFO Test 2")
-        job3_id = self.queue.enqueue(job3_data, "FIFO Test 3")
-
-        # Dequeue them in sequence and verify order
-        job1 = self.queue.dequeue()
-        self.assertEqual(job1[0], job1_id)
-        self.assertEqual(job1[1], job1_data)
-
-        job2 = self.queue.dequeue()
-        self.assertEqual(job2[0], job2_id)
-        self.assertEqual(job2[1], job2_data)
-
-        job3 = self.queue.dequeue()
-        self.assertEqual(job3[0], job3_id)
-        self.assertEqual(job3[1], job3_data)
-
-        # Clean up
-        self.queue.complete(job1_id)
-        self.queue.complete(job2_id)
-        self.queue.complete(job3_id)
-
-    def test_09_get_job_status(self):
-        """Test getting the status of jobs in different states"""
-        self._close_all_open_issues()
-
-        # Create a new job (pending)
-        job_data = {"test": "status_test"}
-        pending_job_id = self.queue.enqueue(job_data, "Status Test - Pending")
-
-        # Get a job for processing
-        self.queue.dequeue()  # Process the pending job
-
-        # Create and complete a job
-        completed_job_id = self.queue.enqueue(job_data, "Status Test - To Complete")
-        self.queue.dequeue()  # Mark as processing
-        self.queue.complete(completed_job_id)
-
-        # Create and fail a job
-        failed_job_id = self.queue.enqueue(job_data, "Status Test - To Fail")
-        self.queue.dequeue()  # Mark as processing
-        self.queue.fail(failed_job_id)
-
-        # Test status for each job
-        self.assertEqual(self.queue.get_job_status(pending_job_id), "processing")  # First job is now processing
-        self.assertEqual(self.queue.get_job_status(completed_job_id), "completed")
-        self.assertEqual(self.queue.get_job_status(failed_job_id), "failed")
-
-        # Create one more pending job to test pending status
-        new_pending_job_id = self.queue.enqueue(job_data, "Status Test - New Pending")
-        self.assertEqual(self.queue.get_job_status(new_pending_job_id), "pending")
+    queue = GithubQueue("test/repo", mirror=mirror)
+
+    assert queue.dequeue() == (5, {"job": 5})
+    verbs = [c[0][0] for c in requester.requestJsonAndCheck.call_args_list]
+    assert verbs == ["DELETE", "POST"]
+    assert mirror.claim()["number"] == 7
+    assert mirror.claim() is None
 
-        # Test non-existent job
-        self.assertIsNone(self.queue.get_job_status(99999))
-
-        # Clean up
-        self.queue.complete(pending_job_id)
-        self.queue.complete(new_pending_job_id)
 
+def test_mirror_claims_without_returning(tmp_path, mocker):
+    """Test that the mirror claims the oldest job on SQLite versions without RETURNING"""
+    mocker.patch("octoqueue.webhook._SQLITE_HAS_RETURNING", False)
+    mirror = JobMirror(str(tmp_path / "queue.db"))
+    for number, created in [(7, "2024-01-02T00:00:00Z"), (5, "2024-01-01T00:00:00Z")]:
+        mirror.update({"number": number, "created_at": created, "state": "open", "labels": [{"name": "pending"}]})
+
+    assert [mirror.claim()["number"], mirror.claim()["number"]] == [5, 7]
+    assert mirror.claim() is None
+
+
+def test_dequeue_empty_queue(mock_repo):
+    """Test that dequeue returns None when no issue is pending"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    mock_repo._requester.requestJsonAndCheck.return_value = ({}, [])
 
-def test_enqueue_with_additional_labels(mock_repo):
-    """Test enqueueing with additional labels"""
     queue = GithubQueue("test/repo")
-    test_data = {"test": "data"}
-    additional_labels = ["mastodon", "custom-label"]
 
-    queue.enqueue(test_data, additional_labels=additional_labels)
+    assert queue.dequeue() is None
 
-    # Verify create_issue was called with all expected labels
-    expected_labels = ["pending"] + additional_labels
-    mock_repo.create_issue.assert_called_once()
-    call_args = mock_repo.create_issue.call_args[1]
-    assert set(call_args["labels"]) == set(expected_labels)
 
+def test_count_open_uses_single_graphql_query(mock_repo):
+    """Test that pending and processing issues are counted with one request"""
+    mock_repo.full_name = "test/repo"
+    mock_repo._requester.graphql_query.return_value = (
+        {},
+        {"data": {"repository": {"pending": {"totalCount": 2}, "processing": {"totalCount": 1}}}},
+    )
 
-def test_enqueue_without_additional_labels(mock_repo):
-    """Test enqueueing without additional labels"""
     queue = GithubQueue("test/repo")
-    test_data = {"test": "data"}
 
-    queue.enqueue(test_data)
+    assert queue.count_open() == 3
+    mock_repo._requester.graphql_query.assert_called_once()
+    assert mock_repo._requester.graphql_query.call_args[0][1] == {"owner": "test", "name": "repo"}
+
+
+def test_get_jobs_with_start_time(mock_repo):
+    """Test that label times come from the GraphQL timeline and pages are followed"""
+    mock_repo.full_name = "test/repo"
+
+    def node(number, labels, events):
+        return {
+            "number": number,
+            "body": f'```json\n{{"n": {number}}}\n```',
+            "labels": {"nodes": [{"name": name} for name in labels]},
+            "timelineItems": {"nodes": [{"createdAt": at, "label": {"name": name}} for name, at in events]},
+        }
+
+    pages = [
+        {
+            "pageInfo": {"endCursor": "c1", "hasNextPage": True},
+            "nodes": [
+                node(1, ["processing"], [("pending", "2024-01-01T00:00:00Z"), ("processing", "2024-01-02T00:00:00Z")]),
+            ],
+        },
+        {
+            "pageInfo": {"endCursor": "c2", "hasNextPage": False},
+            "nodes": [node(2, ["processing"], [("processing", "2024-01-03T00:00:00Z")])],
+        },
+    ]
+    mock_repo._requester.graphql_query.side_effect = [({}, {"data": {"repository": {"issues": p}}}) for p in pages]
+
+    queue = GithubQueue("test/repo")
+    jobs = queue.get_jobs(include_start_time=True)
+
+    assert [(job_id, start.day, data) for job_id, start, data in jobs] == [(1, 2, {"n": 1}), (2, 3, {"n": 2})]
+    assert mock_repo._requester.graphql_query.call_count == 2
+    assert mock_repo._requester.graphql_query.call_args[0][1]["after"] == "c1"
+
+
+def test_enqueue_accepts_non_string_keys(mock_repo):
+    """Test that job data with integer keys is serialized like json.dumps would"""
+    queue = GithubQueue("test/repo")
+
+    queue.enqueue({1: "one", "nested": {2: "two"}})
+
+    body = mock_repo.create_issue.call_args[1]["body"]
+    assert extract_json(body) == {"1": "one", "nested": {"2": "two"}}
+
+
+def test_get_job_status_revalidates_with_etag(mock_repo):
+    """Test that a repeated status lookup sends If-None-Match and reuses the cached issue on 304"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    requester = mock_repo._requester
+    issue_json = b'{"state": "closed", "labels": [{"name": "failed"}]}'
+    requester.requestJson.side_effect = [
+        (200, {"etag": '"abc"'}, issue_json),
+        (304, {"etag": '"abc"'}, b""),
+    ]
+
+    queue = GithubQueue("test/repo")
+
+    assert queue.get_job_status(7) == "failed"
+    assert queue.get_job_status(7) == "failed"
+    first, second = requester.requestJson.call_args_list
+    assert first[0] == ("GET", "https://api.github.com/repos/test/repo/issues/7")
+    assert first[1]["headers"] == {}
+    assert second[1]["headers"] == {"If-None-Match": '"abc"'}
+
+
+def test_get_job_status_unknown_job(mock_repo):
+    """Test that a missing issue has no status"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    mock_repo._requester.requestJson.return_value = (404, {}, b'{"message": "Not Found"}')
+
+    queue = GithubQueue("test/repo")
+
+    assert queue.get_job_status(99999) is None
+
+
+def test_rate_limited_request_is_retried(gh_responses):
+    """Test that a rate-limited request is sent again (responses replays retries without sleeping)"""
+    gh_responses.post(f"{REPO_URL}/issues", status=429, headers={"Retry-After": "30"}, json={"message": "slow down"})
+    gh_responses.post(f"{REPO_URL}/issues", json={"number": 1}, status=201)
+
+    queue = GithubQueue("test/repo")
+    assert queue.enqueue({"key": "value"}) == 1
+
+    assert [call.request.method for call in gh_responses.calls].count("POST") == 2
+
+
+def test_enqueue_is_not_retried_after_server_error(gh_responses):
+    """Test that enqueue does not repeat a POST that may have created the issue"""
+    gh_responses.post(f"{REPO_URL}/issues", status=502, json={"message": "Bad Gateway"})
+    gh_responses.post(f"{REPO_URL}/issues", json={"number": 2}, status=201)
+
+    queue = GithubQueue("test/repo")
+    with pytest.raises(GithubException) as excinfo:
+        queue.enqueue({"key": "value"})
+
+    assert excinfo.value.status == 502
+    assert [call.request.method for call in gh_responses.calls].count("POST") == 1
+    # The second answer was never asked for
+    gh_responses.reset()
+
+
+def test_read_is_retried_after_server_error(gh_responses):
+    """Test that a GET answered with a 5xx is sent again"""
+    gh_responses.get(f"{REPO_URL}/issues/42", status=502, json={"message": "Bad Gateway"})
+    gh_responses.get(f"{REPO_URL}/issues/42", json=_issue_json(42, ["processing"]))
+
+    queue = GithubQueue("test/repo")
+    assert queue.get_job_status(42) == "processing"
+
+
+def test_long_rate_limit_wait_fails_instead_of_blocking(gh_responses):
+    """Test that a request fails right away when the rate limit resets too far in the future"""
+    reset = int(time.time()) + 3600
+    gh_responses.get(
+        f"{REPO_URL}/issues/42",
+        status=403,
+        headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)},
+        json={"message": "API rate limit exceeded for user ID 1."},
+    )
+
+    queue = GithubQueue("test/repo")
+    # Not reported as a missing job
+    with pytest.raises(RateLimitExceededException):
+        queue.get_job_status(42)
+    with pytest.raises(RateLimitExceededException):
+        queue.complete(42)
+
+
+def test_rate_limited_transition_comments_once(gh_responses):
+    """Test that retrying the rate-limited issue update of a transition doesn't post the comment again"""
+    gh_responses.get(f"{REPO_URL}/issues/42", json=_issue_json(42, ["processing"]))
+    gh_responses.patch(f"{REPO_URL}/issues/42", status=429, headers={"Retry-After": "1"}, json={"message": "slow"})
+    gh_responses.patch(f"{REPO_URL}/issues/42", json=_issue_json(42, ["completed"], "closed"))
+    gh_responses.post(f"{REPO_URL}/issues/42/comments", json={"id": 1, "body": "done"}, status=201)
+
+    queue = GithubQueue("test/repo")
+    queue.complete(42, "done")
+
+    methods = [call.request.method for call in gh_responses.calls]
+    assert methods.count("PATCH") == 2
+    assert methods.count("POST") == 1
+
+
+def test_repository_is_looked_up_on_first_use(mock_repo, mocker):
+    """Test that a queue whose labels are known does not call GitHub until it is used"""
+    get_repo = mocker.patch("github.Github.get_repo", return_value=mock_repo)
+    GithubQueue._labels_ensured_repos.add("test/lazy")
+
+    queue = GithubQueue("test/lazy")
+    get_repo.assert_not_called()
+
+    queue.enqueue({"key": "value"})
+    queue.enqueue({"key": "value"})
+    get_repo.assert_called_once_with("test/lazy")
+
+
+def test_get_jobs_fetches_remaining_pages_concurrently(mock_repo):
+    """Test that get_jobs requests all pages named by the first page's Link header"""
+    mock_repo.url = "https://api.github.com/repos/test/repo"
+    link = (
+        '<https://api.github.com/repos/test/repo/issues?per_page=100&page=2>; rel="next", '
+        '<https://api.github.com/repos/test/repo/issues?per_page=100&page=3>; rel="last"'
+    )
+
+    def request(verb, url, parameters):
+        page = parameters["page"]
+        issue = {"number": page, "body": f'```json\n{{"page": {page}}}\n```', "updated_at": "2024-01-01T00:00:00Z"}
+        return ({"link": link} if page == 1 else {}), [issue]
+
+    mock_repo._requester.requestJsonAndCheck.side_effect = request
+
+    queue = GithubQueue("test/repo")
+    jobs = queue.get_jobs(labels=["pending", "mastodon"])
+
+    assert [(job_id, data) for job_id, _, data in jobs] == [(1, {"page": 1}), (2, {"page": 2}), (3, {"page": 3})]
+    assert jobs[0][1].year == 2024
+    parameters = mock_repo._requester.requestJsonAndCheck.call_args_list[0][1]["parameters"]
+    assert parameters == {"labels": "pending,mastodon", "state": "open", "per_page": 100, "page": 1}
+
+
+def test_workers_dequeue_each_job_once(fake_repo):
+    """Test that queues sharing a repository hand out each job once, oldest first"""
+    producer = GithubQueue("test/repo")
+    job_ids = [producer.enqueue({"n": n}) for n in range(3)]
+
+    workers = [GithubQueue("test/repo"), GithubQueue("test/repo")]
+    claimed = [workers[n % 2].dequeue() for n in range(4)]
+
+    assert claimed == [(job_id, {"n": n}) for n, job_id in enumerate(job_ids)] + [None]
+    assert fake_repo.labels.keys() >= {"pending", "processing", "completed", "failed"}
+    assert all(producer.get_job_status(job_id) == "processing" for job_id in job_ids)
+
+
+def test_fake_repo_fails_on_unexpected_requests(fake_repo):
+    """Test that a request the fake doesn't serve fails the test, naming the route"""
+    with pytest.raises(AssertionError, match="Unexpected GitHub request: PUT issues/1/lock"):
+        fake_repo.requestJsonAndCheck("PUT", f"{fake_repo.url}/issues/1/lock")
+
+
+def test_enqueue_many_creates_jobs_in_one_request(fake_repo, mocker):
+    """Test that enqueue_many creates the jobs, in order, with one mutation after the ID lookup"""
+    queue = GithubQueue("test/repo")
+    graphql_query = mocker.spy(fake_repo, "graphql_query")
+
+    job_ids = queue.enqueue_many([{"n": 1}, {"n": 2}], additional_labels=["mastodon"])
+    assert graphql_query.call_count == 2
+    assert queue.enqueue_many([{"n": 3}]) == [job_ids[-1] + 1]
+    assert graphql_query.call_count == 3
+
+    assert [queue.dequeue() for _ in range(3)] == [(job_ids[0], {"n": 1}), (job_ids[1], {"n": 2}), (3, {"n": 3})]
+    assert sorted(job_id for job_id, _, _ in queue.get_jobs(labels=["mastodon"])) == job_ids
+
+
+def test_enqueue_many_falls_back_for_unknown_labels(fake_repo):
+    """Test that labels GraphQL can't find make enqueue_many use the REST API"""
+    queue = GithubQueue("test/repo")
+
+    job_ids = queue.enqueue_many([{"n": 1}, {"n": 2}], additional_labels=["new-label"])
+
+    assert [queue.get_job_status(job_id) for job_id in job_ids] == ["pending", "pending"]
+    assert [label["name"] for label in fake_repo.issues_by_number[job_ids[0]]["labels"]] == ["pending", "new-label"]
+
+
+def test_enqueue_many_reports_jobs_created_before_a_failure(fake_repo, mocker):
+    """Test that a failing batch tells which jobs exist, including those created by the failing request"""
+    mocker.patch("octoqueue.queue.ENQUEUE_BATCH_SIZE", 2)
+    queue = GithubQueue("test/repo")
+    graphql_query = fake_repo.graphql_query
+
+    def fail_second_batch(query, variables):
+        headers, data = graphql_query(query, variables)
+        if "createIssue" in query and variables["title0"] == "c":
+            data["data"]["j1"] = None
+            raise GithubException(200, {**data, "errors": [{"message": "was submitted too quickly"}]}, headers)
+        return headers, data
+
+    mocker.patch.object(fake_repo, "graphql_query", side_effect=fail_second_batch)
+
+    with pytest.raises(EnqueueManyError) as excinfo:
+        queue.enqueue_many([{"n": n} for n in range(4)], titles=["a", "b", "c", "d"])
+    assert excinfo.value.job_ids == [1, 2, 3]
+
+
+def test_enqueue_many_rejects_titles_not_matching_jobs(fake_repo):
+    """Test that enqueue_many refuses a titles list of the wrong length instead of dropping jobs"""
+    queue = GithubQueue("test/repo")
 
-    # Verify create_issue was called with only pending label
-    mock_repo.create_issue.assert_called_once()
-    call_args = mock_repo.create_issue.call_args[1]
-    assert call_args["labels"] == ["pending"]
+    with pytest.raises(ValueError, match="1 titles for 2 jobs"):
+        queue.enqueue_many([{"n": 1}, {"n": 2}], titles=["only one"])
+    assert fake_repo.issues_by_number == {}